@@ -1,7 +1,10 @@
 import numpy as np
 
 class Activator:
-    def __init__(self, f, g, e, make_pattern, hash_pattern, on, off, label):
+    # make_pattern(num_patterns=1) returns (layer_size, num_patterns) random
+    # patterns, drawing the same random numbers as that many single calls
+    # from random_state (default the global np.random)
+    def __init__(self, f, g, e, make_pattern, hash_pattern, on, off, label, dtype=np.float64, threshold=None):
         self.f = f
         self.g = g
         self.e = e
@@ -10,6 +13,9 @@ class Activator:
         self.on = on
         self.off = off
         self.label = label
+        self.dtype = dtype # numeric type of patterns
+        # units above threshold are on, as in hash_pattern
+        self.threshold = (on + off)/2. if threshold is None else threshold
     def gain(self):
         w = (self.g(self.on) - self.g(self.off))/(self.on - self.off)
         b = (self.g(self.off)*self.on - self.g(self.on)*self.off)/(self.on - self.off)
@@ -19,50 +25,74 @@ class Activator:
             np.fabs(pattern - self.on), np.fabs(pattern - self.off)
             ).max()
 
-def tanh_activator(pad, layer_size):
+# activation functions optionally write in place through out=
+
+def logistic(v, out=None):
+    out = np.tanh(v, out=out)
+    out += 1
+    out *= .5
+    return out
+
+def heaviside(v, out=None):
+    if out is None: return (v > .5).astype(float)
+    out[...] = (v > .5)
+    return out
+
+def tanh_activator(pad, layer_size, dtype=np.float64):
     return Activator(
         f = np.tanh,
         g = lambda v: np.arctanh(np.clip(v, pad - 1., 1 - pad)),
         e = lambda a, b: ((a > 0) == (b > 0)),
-        make_pattern = lambda : (1.-pad)*np.sign(np.random.randn(layer_size,1)),
+        make_pattern = lambda num_patterns=1, random_state=np.random: ((1.-pad)*np.sign(
+            random_state.randn(num_patterns,layer_size).T)).astype(dtype, copy=False),
         hash_pattern = lambda p: (p > 0).tobytes(),
+        threshold = 0.,
         on = 1. - pad,
         off = -(1. - pad),
-        label = "tanh")
+        label = "tanh",
+        dtype = dtype)
 
-def logistic_activator(pad, layer_size):
-    def make_pattern():
-        r = np.random.randn(layer_size,1) > 0
-        return (1. - pad)*r + (0. + pad)*(~r)
+def logistic_activator(pad, layer_size, dtype=np.float64):
+    def make_pattern(num_patterns=1, random_state=np.random):
+        r = random_state.randn(num_patterns,layer_size).T > 0
+        return ((1. - pad)*r + (0. + pad)*(~r)).astype(dtype, copy=False)
     return Activator(
-        f = lambda v: .5*(np.tanh(v)+1),
+        f = logistic,
         g = lambda v: np.arctanh(2*np.clip(v, pad, 1. - pad) - 1),
         e = lambda a, b: ((a > .5) == (b > .5)),
         make_pattern = make_pattern,
         hash_pattern = lambda p: (p > .5).tobytes(),
+        threshold = .5,
         on = 1. - pad,
         off = 0. + pad,
-        label = "logistic")
+        label = "logistic",
+        dtype = dtype)
 
-def heaviside_activator(layer_size):
+def heaviside_activator(layer_size, dtype=np.float64):
     return Activator(
-        f = lambda v: (v > .5).astype(float),
+        f = heaviside,
         g = lambda v: (-1.)**(v < .5),
         e = lambda a, b: ((a > .5) == (b > .5)),
-        make_pattern = lambda : (np.random.randn(layer_size,1) > 0).astype(float),
+        make_pattern = lambda num_patterns=1, random_state=np.random: (
+            random_state.randn(num_patterns,layer_size).T > 0).astype(dtype),
         hash_pattern = lambda p: (p > .5).tobytes(),
+        threshold = .5,
         on = 1.,
         off = 0.,
-        label = "heaviside")
+        label = "heaviside",
+        dtype = dtype)
 
-def gate_activator(pad, layer_size):
+def gate_activator(pad, layer_size, dtype=np.float64):
     return Activator(
         f = np.tanh,
         g = lambda v: np.arctanh(np.clip(v, 0., 1. - pad)),
         e = lambda a, b: ((a > .5) == (b > .5)),
-        make_pattern = lambda : (1.-pad)*(np.random.randn(layer_size,1) > 0.),
+        make_pattern = lambda num_patterns=1, random_state=np.random: ((1.-pad)*(
+            random_state.randn(num_patterns,layer_size).T > 0.)).astype(dtype, copy=False),
         hash_pattern = lambda p: (p > .5).tobytes(),
+        threshold = .5,
         on = 1. - pad,
         off = 0.,
-        label = "gate")
+        label = "gate",
+        dtype = dtype)
 
@@ -0,0 +1,33 @@
+import numpy as np
+
+class ActivityBuffer(dict):
+    """
+    Preallocated activity patterns for every layer of a network.
+    All layers are views into one contiguous array, one column per instance.
+    Assigning a pattern to a layer copies it into the preallocated view, so
+    the arrays owned by the buffer are never replaced (or shared with coders).
+    """
+
+    def __init__(self, layers, batch_size=1, dtype=np.float64):
+        """
+        layers: dict of layers
+        batch_size: number of columns (instances) per layer
+        """
+        super(ActivityBuffer, self).__init__()
+        self.batch_size = batch_size
+        self.offsets = {} # layer name -> (start, end) of its rows in data
+        total = sum(layer.size for layer in layers.values())
+        self.data = np.zeros((total, batch_size), dtype=dtype)
+        offset = 0
+        for name, layer in layers.items():
+            self.offsets[name] = (offset, offset + layer.size)
+            dict.__setitem__(self, name, self.data[offset:offset + layer.size])
+            offset += layer.size
+
+    def __setitem__(self, name, pattern):
+        view = self[name]
+        if pattern is not view: np.copyto(view, pattern)
+
+    def update(self, *args, **kwargs):
+        for name, pattern in dict(*args, **kwargs).items():
+            self[name] = pattern
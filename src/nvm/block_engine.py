@@ -0,0 +1,107 @@
+import numpy as np
+
+class BlockEngine:
+    """
+    Packed execution engine for NVMNet.tick.
+    All incoming weight matrices and biases of a target layer are stored side
+    by side in one contiguous block matrix, so that the gated sum for the layer
+    is a single matrix-vector product with a gate-scaled stacked input.
+    The entries of net.weights and net.biases are replaced by views into the
+    blocks, so in-place updates (plasticity, assembly) stay in sync.
+    Weights that are not dense arrays (e.g. low rank) are left unpacked.
+    Blocks stored at lower precision than dtype (e.g. float16 weights) are
+    multiplied as a persistent copy in dtype, refreshed after weights_changed.
+    """
+
+    def __init__(self, weights, biases, layers, dtype=np.float64):
+        """
+        weights, biases: dicts of (to_layer, from_layer) -> matrix, as in NVMNet
+        layers: dict of all layers
+        dtype: numeric type of the stacked inputs and results
+        """
+        self.blocks = {} # to_layer -> block matrix [W_1 ... W_K, b_1 ... b_K]
+        self.inputs = {} # to_layer -> stacked gate-scaled input buffer
+        self.offsets = {} # pathway -> (column offset, bias column, size)
+        self.views = {} # pathway -> (weight, bias) views, to detect replacement
+        self.unpacked = [] # pathways whose weights are not dense arrays
+        self.compute = {} # to_layer -> block copy in dtype, if lower precision
+        self.changed = set() # to_layers whose compute copies are out of date
+
+        incoming = {}
+        for (to_layer, from_layer) in weights:
+            if not isinstance(weights[(to_layer, from_layer)], np.ndarray):
+                self.unpacked.append((to_layer, from_layer))
+                continue
+            incoming.setdefault(to_layer, []).append(from_layer)
+
+        for to_layer, from_layers in incoming.items():
+            sizes = [layers[from_layer].size for from_layer in from_layers]
+            num_columns = sum(sizes) + len(from_layers)
+            block = np.zeros((layers[to_layer].size, num_columns),
+                dtype=np.result_type(*[weights[(to_layer, from_layer)]
+                    for from_layer in from_layers]))
+
+            offset, bias_column = 0, sum(sizes)
+            for from_layer, size in zip(from_layers, sizes):
+                key = (to_layer, from_layer)
+                block[:, offset:offset+size] = weights[key]
+                block[:, bias_column:bias_column+1] = biases[key]
+                weights[key] = block[:, offset:offset+size]
+                biases[key] = block[:, bias_column:bias_column+1]
+                self.offsets[key] = (offset, bias_column, size)
+                self.views[key] = (weights[key], biases[key])
+                offset += size
+                bias_column += 1
+
+            self.blocks[to_layer] = block
+            if block.dtype.itemsize < np.dtype(dtype).itemsize:
+                self.compute[to_layer] = block.astype(dtype)
+            self.inputs[to_layer] = np.zeros((num_columns, 1),
+                dtype=np.result_type(dtype, block))
+
+    def is_stale(self, weights, biases, pathways=None):
+        """
+        Whether pathways were added or matrices replaced since packing
+        If pathways is provided, only those matrices are checked for replacement
+        """
+        if len(weights) != len(self.views) + len(self.unpacked): return True
+        if any(isinstance(weights[key], np.ndarray) for key in self.unpacked):
+            return True # densified
+        if pathways is None: pathways = self.views.keys()
+        pathways = [key for key in pathways if key in self.views]
+        return any(
+            weights[key] is not self.views[key][0] or
+            biases[key] is not self.views[key][1]
+            for key in pathways)
+
+    def weights_changed(self, pathways=None):
+        """Note in-place updates of the given pathways (default all)"""
+        if pathways is None: self.changed.update(self.compute.keys())
+        else: self.changed.update(to_layer for (to_layer, _) in pathways)
+
+    def forward(self, to_layer, gated, activity, out=None):
+        """
+        Gated sum of all inputs to a target layer
+        gated: list of (from_layer, scale) for pathways with open gates
+        activity: dict of current layer activity, one column per instance
+        out: optional preallocated array for the result
+        """
+        x = self.inputs[to_layer]
+        batch_size = activity[to_layer].shape[1]
+        if x.shape[1] != batch_size:
+            x = np.zeros((x.shape[0], batch_size), dtype=x.dtype)
+            self.inputs[to_layer] = x
+        x[:] = 0
+        for from_layer, scale in gated:
+            offset, bias_column, size = self.offsets[(to_layer, from_layer)]
+            x[offset:offset+size] = scale * activity[from_layer]
+            x[bias_column] = scale
+        block = self.blocks[to_layer]
+        if to_layer in self.compute:
+            if to_layer in self.changed:
+                np.copyto(self.compute[to_layer], block)
+                self.changed.discard(to_layer)
+            block = self.compute[to_layer]
+        # dot only writes into out of the exact result type
+        if out is not None and out.dtype != np.result_type(block, x): out = None
+        return block.dot(x, out=out)
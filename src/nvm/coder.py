@@ -1,5 +1,50 @@
+import hashlib
 import numpy as np
 import itertools as it
+from collections import OrderedDict
+from hamming_index import HammingIndex, popcounts
+
+def seeded_random_state(seed, key):
+    """
+    RandomState determined only by (seed, key), identical in every process:
+    a counter-based Philox generator keyed by a hash of their strings.
+    """
+    digest = hashlib.sha256(("%s\x00%s" % (seed, key)).encode("utf-8")).digest()
+    return np.random.RandomState(np.random.Philox(key=int.from_bytes(digest[:16], "little")))
+
+class PackedPatterns:
+    """
+    Read-only token -> pattern mapping for a packed Coder.
+    Float patterns are materialized from the packed bit rows on access and
+    kept in a small least-recently-used cache.
+    """
+
+    def __init__(self, coder, cache_size):
+        self.coder = coder
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+
+    def __contains__(self, token):
+        return token in self.coder.rows or token in self.coder.unpackable
+
+    def __len__(self):
+        return len(self.coder.rows) + len(self.coder.unpackable)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return list(self.coder.rows.keys()) + list(self.coder.unpackable.keys())
+
+    def __getitem__(self, token):
+        if token in self.coder.unpackable: return self.coder.unpackable[token]
+        if token in self.cache:
+            self.cache.move_to_end(token)
+            return self.cache[token]
+        pattern = self.coder.unpack(self.coder.rows[token])
+        self.cache[token] = pattern
+        if len(self.cache) > self.cache_size: self.cache.popitem(last=False)
+        return pattern
 
 class Coder:
     """
@@ -8,16 +53,65 @@ class Coder:
     patterns must be convertable to hashable type for storage in dicts.
     """
 
-    def __init__(self, activator):
+    def __init__(self, activator, packed=False, cache_size=64, index_radius=None, seed=None):
         """
         Set up a coder with a supplied pattern maker function.
         Patterns will be generated by calling activator.make_pattern.
         Patterns will be hashed by calling activator.hash_pattern.
+        If packed, binary (on/off) patterns are stored as np.packbits rows in
+        one shared array, hashed on the packed bytes, and materialized as
+        floats on demand (the last cache_size are cached).
+        If index_radius is given, codes are also kept in a HammingIndex for
+        decode_within.
+        If seed is given, each generated pattern depends only on (seed, token),
+        not on encoding order or global random state, so it can be regenerated
+        anywhere (see seeded_patterns), e.g. by a worker process.
         """
         self.activator = activator
-        self.encodings = {} # maps tokens to patterns
+        self.packed = packed
+        self.seed = seed
         self.decodings = {} # maps patterns to tokens
-        
+        if packed:
+            self.rows = {} # maps tokens to rows of codes (below)
+            self.unpackable = {} # maps tokens to patterns that are not binary
+            self.encodings = PackedPatterns(self, cache_size)
+        else:
+            self.encodings = {} # maps tokens to patterns
+
+        # patterns generated by make_pattern, one column each, see encode_many
+        self.matrix = None # allocated on first generation, grown by doubling
+        self.columns = {} # maps tokens to columns of matrix
+
+        # activator.g of encodings, computed once, see encode_g and encode_many_g
+        self.g_encodings = {} # maps tokens to g patterns
+        self.g_matrix = None # g of the first g_count columns of matrix
+        self.g_count = 0
+
+        # +/-1 codes of all decodable patterns, one row each, for decode_nearest
+        # if packed, np.packbits bytes
+        self.codes = None # allocated on first encoding, grown by doubling
+        self.size = None # number of units per pattern
+        self.code_keys = [] # row -> key in decodings
+        self.code_index = {} # key in decodings -> row
+        self.separation = {} # row -> Hamming distance to nearest other code, computed on demand
+
+        # multi-index hash of the codes, allocated on first encoding
+        self.index_radius = index_radius
+        self.index = None
+
+    def get_tables(self):
+        """All encodings and decodings as a picklable dict, see set_tables"""
+        tables = dict(self.__dict__)
+        del tables["activator"]
+        if self.packed: del tables["encodings"] # a view of rows and unpackable
+        return tables
+
+    def set_tables(self, tables):
+        """Replace all encodings and decodings with those from get_tables"""
+        cache_size = self.encodings.cache_size if self.packed else None
+        self.__dict__.update(tables)
+        if self.packed: self.encodings = PackedPatterns(self, cache_size)
+
     def list_tokens(self):
         """Return a list of all tokens encoded so far."""
         return self.encodings.keys()
@@ -30,17 +124,255 @@ class Coder:
         """
         # Encode if not already encoded
         if token not in self.encodings:
-            if pattern is None: pattern = self.activator.make_pattern()
-            self.encodings[token] = pattern
-            self.decodings[self.activator.hash_pattern(pattern)] = token
+            if pattern is None:
+                self._add_generated([token])
+                return self.encodings[token]
+            key = self.hash_pattern(pattern)
+            self.decodings[key] = token
+            if key not in self.code_index: self._add_codes([key], pattern)
+            if self.packed: self._add_packed(token, key, pattern)
+            else: self.encodings[token] = pattern
         return self.encodings[token]
 
+    def encode_many(self, tokens):
+        """
+        Return an (N, T) array of the patterns encoding a list of T tokens.
+        Tokens not already encoded get patterns from a single make_pattern
+        call. Generated patterns are stored as columns of one contiguous
+        matrix, so unless some token was encoded with a given pattern, the
+        result is a view of (consecutive) or gather from that matrix.
+        """
+        missing, seen = [], set()
+        for token in tokens:
+            if token not in self.encodings and token not in seen:
+                missing.append(token)
+                seen.add(token)
+        if len(missing) > 0: self._add_generated(missing)
+
+        if not self.packed and all(token in self.columns for token in tokens):
+            columns = [self.columns[token] for token in tokens]
+            start = columns[0]
+            if columns == list(range(start, start + len(columns))):
+                return self.matrix[:, start:start + len(columns)]
+            return self.matrix[:, columns]
+        return np.concatenate([self.encodings[token] for token in tokens], axis=1)
+
+    def encode_g(self, token, pattern=None):
+        """
+        activator.g of the pattern encoding a token (encoding it as in encode
+        if necessary), i.e. the pre-activation that produces the pattern.
+        Cached, since encodings never change once made.
+        """
+        if token not in self.g_encodings:
+            self.g_encodings[token] = self.activator.g(self.encode(token, pattern))
+        return self.g_encodings[token]
+
+    def encode_many_g(self, tokens):
+        """
+        (N, T) activator.g of encode_many(tokens), computed once per token.
+        g of generated patterns is kept in a matrix parallel to the encoding
+        matrix, so the result is a view or gather as in encode_many.
+        """
+        self.encode_many(tokens) # encode any new tokens
+        if self.packed or not all(token in self.columns for token in tokens):
+            return np.concatenate([self.encode_g(token) for token in tokens], axis=1)
+
+        # extend g to columns generated since the last call
+        k = len(self.columns)
+        if self.g_matrix is None or self.g_matrix.shape != self.matrix.shape:
+            g_matrix = np.empty(self.matrix.shape, dtype=self.matrix.dtype)
+            if self.g_matrix is not None: g_matrix[:,:self.g_count] = self.g_matrix[:,:self.g_count]
+            self.g_matrix = g_matrix
+        if self.g_count < k:
+            self.g_matrix[:,self.g_count:k] = self.activator.g(self.matrix[:,self.g_count:k])
+            self.g_count = k
+
+        columns = [self.columns[token] for token in tokens]
+        start = columns[0]
+        if columns == list(range(start, start + len(columns))):
+            return self.g_matrix[:, start:start + len(columns)]
+        return self.g_matrix[:, columns]
+
+    def _add_generated(self, tokens):
+        # encode new tokens with patterns from one make_pattern call,
+        # or one per token from its own seeded random state
+        if self.seed is None: patterns = self.activator.make_pattern(len(tokens))
+        else: patterns = self.seeded_patterns(tokens)
+        keys = [self.hash_pattern(patterns[:,[t]]) for t in range(len(tokens))]
+        for token, key in zip(tokens, keys): self.decodings[key] = token
+        new_keys, new_columns = [], []
+        for t, key in enumerate(keys):
+            if key not in self.code_index and key not in new_keys:
+                new_keys.append(key)
+                new_columns.append(t)
+        if len(new_keys) > 0: self._add_codes(new_keys, patterns[:,new_columns])
+
+        if self.packed:
+            for t, (token, key) in enumerate(zip(tokens, keys)):
+                self._add_packed(token, key, patterns[:,[t]])
+            return
+
+        # store in the matrix of generated patterns
+        if self.matrix is None:
+            self.matrix = np.empty((patterns.shape[0], max(16, len(tokens))), dtype=patterns.dtype)
+        k = len(self.columns)
+        if k + len(tokens) > self.matrix.shape[1]:
+            matrix = np.empty((self.matrix.shape[0], 2*(k + len(tokens))), dtype=self.matrix.dtype)
+            matrix[:,:k] = self.matrix[:,:k]
+            self.matrix = matrix
+            for token, column in self.columns.items():
+                self.encodings[token] = self.matrix[:, column:column+1]
+        self.matrix[:, k:k + len(tokens)] = patterns
+        for t, token in enumerate(tokens):
+            self.columns[token] = k + t
+            self.encodings[token] = self.matrix[:, k+t:k+t+1]
+
+    def seeded_patterns(self, tokens):
+        """
+        (N, T) patterns generated for a list of T tokens in seeded mode,
+        recomputed from the seed whether or not the tokens are encoded.
+        """
+        return np.concatenate([
+            self.activator.make_pattern(1, seeded_random_state(self.seed, token))
+            for token in tokens], axis=1)
+
     def decode(self, pattern):
         """
         Decode a pattern into a token.
         If no token has been encoded as the pattern, the default is "?"
         """
-        return self.decodings.get(self.activator.hash_pattern(pattern), "?")
+        return self.decodings.get(self.hash_pattern(pattern), "?")
+
+    def hash_pattern(self, pattern):
+        """activator.hash_pattern, or the packed bits if packed"""
+        if not self.packed: return self.activator.hash_pattern(pattern)
+        return self.hash_bits(self.activator.e(
+            pattern.reshape(-1), self.activator.on))
+
+    def hash_bits(self, bits):
+        """Decode table key of a pattern already thresholded to bools"""
+        if not self.packed: return bits.tobytes()
+        return np.packbits(bits).tobytes()
+
+    def unpack(self, row):
+        """Float (N,1) pattern for a row of packed codes"""
+        on, off = self.activator.on, self.activator.off
+        bits = np.unpackbits(self.codes[row])[:self.size]
+        return np.where(bits, on, off).astype(self.activator.dtype).reshape(-1, 1)
+
+    def _add_packed(self, token, key, pattern):
+        # binary patterns (up to rounding) are kept as bits only
+        row = self.code_index[key]
+        if np.allclose(self.unpack(row), pattern.reshape(-1, 1)):
+            self.rows[token] = row
+        else:
+            self.unpackable[token] = pattern
+
+    def _binarize(self, patterns):
+        # one row per pattern: +1 where the activator considers a unit on,
+        # -1 where off, or the packed on bits if packed
+        on = self.activator.e(patterns, self.activator.on).T
+        if self.packed: return np.packbits(on, axis=1)
+        return np.where(on, 1., -1.).astype(np.float32)
+
+    def _distances(self, K, codes):
+        # Hamming distances from the first K codes to others (K x rows of codes)
+        if self.packed:
+            return popcounts[self.codes[:K,np.newaxis,:] ^ codes[np.newaxis,:,:]
+                ].sum(axis=2, dtype=int)
+        return np.rint((self.size - self.codes[:K].dot(codes.T))/2).astype(int)
+
+    def _add_codes(self, keys, patterns):
+        # add the codes of new decodable patterns, one row each
+        code = self._binarize(patterns.reshape(patterns.shape[0], -1))
+        k, P = len(self.code_keys), len(keys)
+        if self.codes is None:
+            self.size = patterns.shape[0]
+            self.codes = np.empty((max(16, P), code.shape[1]), dtype=code.dtype)
+        while k + P > self.codes.shape[0]:
+            self.codes = np.concatenate((self.codes, np.empty(self.codes.shape, dtype=code.dtype)))
+        self.codes[k:k+P] = code
+        self.separation.clear() # new codes may be nearer
+
+        for p, key in enumerate(keys):
+            self.code_index[key] = k + p
+            self.code_keys.append(key)
+
+        if self.index_radius is not None:
+            if self.index is None: self.index = HammingIndex(self.size, self.index_radius)
+            on = self.activator.e(patterns, self.activator.on)
+            for p in range(P): self.index.add(on[:,p], k + p)
+
+    def decode_nearest(self, pattern):
+        """
+        Decode a pattern into the token whose pattern is nearest in Hamming
+        distance, after thresholding units as in hash_pattern.
+        pattern: (N,) or (N,1) array, or (N,B) array of B patterns
+        Returns (token, distance, margin), where margin is how much further the
+        next nearest encoded pattern is, or lists of each for B > 1 patterns.
+        Exact matches are found by hash; the rest in one matrix product
+        (or one popcount pass if packed).
+        If nothing is encoded yet, the token is "?".
+        """
+        patterns = pattern.reshape(pattern.shape[0], -1)
+        B, N, K = patterns.shape[1], patterns.shape[0], len(self.code_keys)
+        tokens = ["?"] * B
+        distances, margins = np.full(B, N), np.zeros(B, dtype=int)
+
+        # exact matches
+        misses, matches = [], []
+        for b in range(B):
+            key = self.hash_pattern(patterns[:,[b]])
+            if key in self.code_index:
+                tokens[b] = self.decodings[key]
+                distances[b] = 0
+                matches.append((b, self.code_index[key]))
+            else: misses.append(b)
+
+        # their margins are the distances to the nearest other codes
+        rows = list(set(row for (_, row) in matches if row not in self.separation))
+        if len(rows) > 0:
+            D = self._distances(K, self.codes[rows])
+            D[rows, np.arange(len(rows))] = N # not to themselves
+            self.separation.update(zip(rows, D.min(axis=0).tolist()))
+        for b, row in matches: margins[b] = self.separation[row]
+
+        # nearest codes for the rest
+        if len(misses) > 0 and K > 0:
+            D = self._distances(K, self._binarize(patterns[:,misses]))
+            nearest = D.argmin(axis=0)
+            D.sort(axis=0)
+            for m, b in enumerate(misses):
+                tokens[b] = self.decodings[self.code_keys[nearest[m]]]
+                distances[b] = D[0,m]
+                margins[b] = (D[1,m] if K > 1 else N) - D[0,m]
+
+        if B == 1: return tokens[0], int(distances[0]), int(margins[0])
+        return tokens, distances.tolist(), margins.tolist()
+
+    def decode_within(self, pattern):
+        """
+        Decode a pattern into the nearest token within index_radius Hamming
+        distance, searching the index instead of scanning every code.
+        pattern: (N,) or (N,1) array, or (N,B) array of B patterns
+        Returns (token, distance), or ("?", -1) if no token is that near,
+        or lists of each for B > 1 patterns.
+        """
+        patterns = pattern.reshape(pattern.shape[0], -1)
+        tokens, distances = [], []
+        for b in range(patterns.shape[1]):
+            key = self.hash_pattern(patterns[:,[b]])
+            if key in self.code_index: token, distance = self.decodings[key], 0
+            elif self.index is None: token, distance = "?", -1
+            else:
+                k, distance = self.index.query(
+                    self.activator.e(patterns[:,b], self.activator.on))
+                token = "?" if k is None else self.decodings[self.code_keys[k]]
+            tokens.append(token)
+            distances.append(distance)
+
+        if len(tokens) == 1: return tokens[0], distances[0]
+        return tokens, distances
 
 if __name__ == "__main__":
     
@@ -241,7 +241,8 @@ if __name__ == "__main__":
             break
         nvm.net.tick()
 
-        history.append(dict(nvm.net.activity))
+        history.append({name: pattern.copy()
+            for name, pattern in nvm.net.activity.items()})
 
     # ### Grid history
     # for i, (r, c, grid_i) in enumerate(grids):
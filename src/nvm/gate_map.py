@@ -1,3 +1,5 @@
+import numpy as np
+
 class GateMap:
     def __init__(self, gate_keys):
     
@@ -6,6 +8,17 @@ class GateMap:
         self.gate_index = {k:i
             for i,k in enumerate(gate_keys)} # keys to indices
 
+        # array views of the keys, by index: to/from layer ids and gate type
+        self.layer_names = [] # ids to layer names
+        for (to_layer, from_layer, _) in self.gate_keys:
+            for name in (to_layer, from_layer):
+                if name not in self.layer_names: self.layer_names.append(name)
+        self.layer_ids = {name:i
+            for i,name in enumerate(self.layer_names)} # layer names to ids
+        self.to_ids = np.array([self.layer_ids[k[0]] for k in self.gate_keys], dtype=int)
+        self.from_ids = np.array([self.layer_ids[k[1]] for k in self.gate_keys], dtype=int)
+        self.gate_types = np.array([k[2] for k in self.gate_keys])
+
     def get_gate_count(self):
         return len(self.gate_index)
 
@@ -22,6 +35,28 @@ class GateMap:
         Returns the activation value in gate_pattern for a particular gate_key
         """
         return gate_pattern[self.gate_index[gate_key], 0]
+
+    def get_gate_indices(self, to_layer=None, from_layer=None, gate_type=None):
+        """
+        Returns the array of gate indices whose keys match the given to layer,
+        from layer and gate type (None matches any)
+        """
+        match = np.ones(len(self.gate_keys), dtype=bool)
+        for ids, name in [(self.to_ids, to_layer), (self.from_ids, from_layer)]:
+            if name is None: continue
+            if name not in self.layer_ids: return np.empty(0, dtype=int)
+            match &= (ids == self.layer_ids[name])
+        if gate_type is not None: match &= (self.gate_types == gate_type)
+        return np.flatnonzero(match)
+
+    def get_open_indices(self, gate_pattern, on, off, indices=None):
+        """
+        Returns the array of gate indices (optionally among given indices)
+        whose values in gate_pattern are nearer to on than off
+        """
+        g = gate_pattern[:, 0] if indices is None else gate_pattern[indices, 0]
+        open_gates = np.flatnonzero(np.fabs(g - on) < np.fabs(g - off))
+        return open_gates if indices is None else indices[open_gates]
     
 def make_nvm_gate_map(layers):
     """layers: dict of layers"""
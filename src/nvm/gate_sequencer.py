@@ -22,10 +22,15 @@ class GateSequencer(Sequencer, object):
                 (gate_output.name, gate_output.name, 'd')]
         self.default_gates = default_gates
 
+        # indices of the update gates into the hidden layer
+        self.hidden_update_gates = gate_map.get_gate_indices(
+            to_layer=gate_hidden.name, gate_type='u')
+
     def make_gate_output(self, ungate=[]):
         """Make gate output pattern where specified gate key units are on"""
 
-        pattern = self.gate_output.activator.off * np.ones((self.gate_output.size,1))
+        pattern = self.gate_output.activator.off * np.ones((self.gate_output.size,1),
+            dtype=self.gate_output.activator.dtype)
 
         # Ungate provided keys
         for k in self.default_gates + ungate:
@@ -37,8 +42,8 @@ class GateSequencer(Sequencer, object):
     def add_transit(self, ungate=[], intermediate_ungate=[], new_gates=None, new_hidden=None, intermediate_gates=None, old_gates=None, old_hidden=None, **input_states):
 
         # Default to random hidden patterns
-        if old_hidden is None: old_hidden = self.gate_hidden.activator.make_pattern()
-        if new_hidden is None: new_hidden = self.gate_hidden.activator.make_pattern()
+        if old_hidden is None: old_hidden = self.gate_hidden.activator.make_pattern(random_state=self.random_state)
+        if new_hidden is None: new_hidden = self.gate_hidden.activator.make_pattern(random_state=self.random_state)
 
         # Default old gates to off
         if old_gates is None: old_gates = self.make_gate_output()
@@ -52,16 +57,15 @@ class GateSequencer(Sequencer, object):
                     "Using input from layer that is not ungated! Expected "+str(gate_key))
 
         # Error if ungated layers not provided as input
-        for p in range(old_gates.shape[0]):
-            if old_gates[p,0] == self.gate_output.activator.on:
-                gate_key = self.gate_map.get_gate_key(p)
-                to_name, from_name, gate_type = gate_key
-                if not to_name == self.gate_hidden.name: continue
-                if not gate_type == 'u': continue
-                if from_name in input_states: continue
-                if from_name == self.gate_hidden.name: continue
-                raise Exception(
-                    "No input provided for ungated layer!  Expected "+str(gate_key))
+        ungated = self.hidden_update_gates[
+            old_gates[self.hidden_update_gates, 0] == self.gate_output.activator.on]
+        for p in ungated:
+            gate_key = self.gate_map.get_gate_key(p)
+            to_name, from_name, gate_type = gate_key
+            if from_name in input_states: continue
+            if from_name == self.gate_hidden.name: continue
+            raise Exception(
+                "No input provided for ungated layer!  Expected "+str(gate_key))
 
         # Provide new gates, or ungate, but not both
         if len(ungate) > 0 and new_gates is not None:
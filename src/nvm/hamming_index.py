@@ -0,0 +1,119 @@
+import itertools as it
+import numpy as np
+
+# number of set bits in each byte value
+popcounts = np.array([bin(b).count("1") for b in range(256)], dtype=np.uint8)
+
+class HammingIndex:
+    """
+    Multi-index hashing of binary codes, for near neighbor search in sub-linear time.
+    Codes are split into disjoint substrings, each hashed in its own table.
+    By pigeonhole, a code within Hamming radius r of a query differs from it
+    in at most r // num_substrings bits on some substring, so only the codes in
+    the buckets near the query's substrings are candidates, and those are
+    checked exactly. Search within the radius is therefore exact; codes can be
+    added one at a time.
+    """
+
+    def __init__(self, num_bits, radius, num_substrings=None):
+        """
+        num_bits: length of the codes
+        radius: largest Hamming distance searched
+        num_substrings: default radius + 1, so that buckets are matched exactly
+        """
+        if num_substrings is None: num_substrings = radius + 1
+        num_substrings = max(1, min(num_substrings, num_bits))
+        self.num_bits = num_bits
+        self.radius = radius
+        bounds = np.linspace(0, num_bits, num_substrings + 1).astype(int)
+        self.substrings = list(zip(bounds[:-1], bounds[1:]))
+        self.sub_radius = radius // num_substrings
+        self.tables = [{} for _ in self.substrings] # substring key -> code indices
+        self.codes = np.empty((16, (num_bits + 7)//8), dtype=np.uint8) # packed, grown by doubling
+        self.values = [] # code index -> value
+
+    def __len__(self):
+        return len(self.values)
+
+    def _probe_keys(self, bits, s, e, radius):
+        # keys of every substring within radius of bits[s:e]
+        sub = bits[s:e].copy()
+        for r in range(radius + 1):
+            for flips in it.combinations(range(e - s), r):
+                sub[list(flips)] ^= True
+                yield np.packbits(sub).tobytes()
+                sub[list(flips)] ^= True
+
+    def add(self, bits, value):
+        """Add a code (bool array of num_bits) with an associated value"""
+        bits = bits.reshape(-1)
+        i = len(self.values)
+        if i == self.codes.shape[0]:
+            self.codes = np.concatenate((self.codes, np.empty(self.codes.shape, dtype=np.uint8)))
+        self.codes[i] = np.packbits(bits)
+        for table, (s, e) in zip(self.tables, self.substrings):
+            table.setdefault(np.packbits(bits[s:e]).tobytes(), []).append(i)
+        self.values.append(value)
+
+    def candidates(self, bits):
+        """Sorted indices of the codes in the buckets probed for a query"""
+        bits = bits.reshape(-1)
+        found = set()
+        for table, (s, e) in zip(self.tables, self.substrings):
+            for key in self._probe_keys(bits, s, e, self.sub_radius):
+                found.update(table.get(key, ()))
+        return np.array(sorted(found), dtype=int)
+
+    def query(self, bits):
+        """
+        Nearest code to a query (bool array of num_bits) within the radius.
+        Returns (value, distance), or (None, -1) if no code is that near.
+        Ties go to the earliest added code.
+        """
+        candidates = self.candidates(bits)
+        if len(candidates) == 0: return None, -1
+        distances = popcounts[self.codes[candidates] ^ np.packbits(bits.reshape(-1))
+            ].sum(axis=1, dtype=int)
+        nearest = distances.argmin()
+        if distances[nearest] > self.radius: return None, -1
+        return self.values[candidates[nearest]], int(distances[nearest])
+
+if __name__ == "__main__":
+
+    # recall and speed against exact search, on random codes
+    import time
+    N, V, Q, radius = 1024, 20000, 500, 48
+    codes = np.random.randn(V, N) > 0
+    index = HammingIndex(N, radius)
+    for v in range(V): index.add(codes[v], v)
+    packed = np.packbits(codes, axis=1)
+
+    # queries: codes with up to twice the radius of their bits flipped
+    targets = np.random.randint(V, size=Q)
+    flips = np.random.randint(2*radius + 1, size=Q)
+    queries = codes[targets].copy()
+    for q in range(Q):
+        queries[q, np.random.choice(N, flips[q], replace=False)] ^= True
+
+    start = time.time()
+    exact = []
+    for q in range(Q):
+        distances = popcounts[packed ^ np.packbits(queries[q])].sum(axis=1, dtype=int)
+        exact.append((distances.argmin(), distances.min()))
+    exact_time = time.time() - start
+
+    start = time.time()
+    results = [index.query(queries[q]) for q in range(Q)]
+    index_time = time.time() - start
+    num_candidates = np.mean([len(index.candidates(queries[q])) for q in range(Q)])
+
+    within = [q for q in range(Q) if exact[q][1] <= radius]
+    hits = [q for q in within if results[q] == (exact[q][0], exact[q][1])]
+    false_hits = [q for q in range(Q) if q not in within and results[q][0] is not None]
+    print("%d codes of %d bits, radius %d, %d substrings of %d bits"%(
+        V, N, radius, len(index.substrings), N // len(index.substrings)))
+    print("recall within radius: %d/%d"%(len(hits), len(within)))
+    print("false hits beyond radius: %d"%len(false_hits))
+    print("mean candidates per query: %.1f of %d"%(num_candidates, V))
+    print("exact search: %.2fms/query, index: %.2fms/query"%(
+        1000*exact_time/Q, 1000*index_time/Q))
@@ -0,0 +1,123 @@
+import warnings
+import numpy as np
+from numpy.lib.format import open_memmap
+
+class HealthWarning(UserWarning):
+    """Early warning that a layer's activity is degrading, see HealthMonitor"""
+    pass
+
+class HealthMonitor:
+    """
+    Numerical health of NVMNet activity, sampled every few ticks, see
+    NVMNet.start_monitoring. For every layer (and batched instance):
+        corrosion: largest distance of a unit from on or off (Activator.corrosion)
+        margin: smallest distance of a unit from the threshold, i.e. how
+            close the decoded pattern is to flipping a unit
+        near: number of units within epsilon of the threshold
+    All layers are measured at once from the contiguous activity buffer, and
+    samples are written into a preallocated ring buffer of records, which can
+    be a memory-mapped .npy file.
+    Warnings (HealthWarning) are raised when a layer first crosses a limit.
+    """
+
+    def __init__(self, layers, every=1, capacity=4096, epsilon=.05,
+        max_corrosion=None, min_margin=None, max_near=None, filename=None):
+        """
+        layers: dict of all layers
+        every: sample once this many ticks
+        capacity: number of samples kept, oldest are overwritten
+        epsilon: distance from the threshold counted as near
+        max_corrosion, min_margin, max_near: warning limits (None for no
+            warnings), either one value or a dict with one per layer name
+        filename: optional .npy file to memory-map the samples into
+        """
+        self.layers = layers
+        self.every = every
+        self.capacity = capacity
+        self.epsilon = epsilon
+        self.limits = {"corrosion": max_corrosion, "margin": min_margin, "near": max_near}
+        self.filename = filename
+
+        self.ticks = 0
+        self.count = 0 # number of samples taken
+        self.records = None # allocated on first sample
+        self.unhealthy = set() # (layer name, metric) currently past a limit
+        self.warnings = [] # (tick, layer name, metric, value) of each warning
+
+    def _allocate(self, activity):
+        # per-row constants in buffer order, and the first row of each layer
+        offsets = activity.offsets
+        self.layer_names = sorted(offsets.keys(), key=lambda name: offsets[name][0])
+        self.starts = np.array([offsets[name][0] for name in self.layer_names])
+        def per_row(value):
+            return np.concatenate([
+                np.full(offsets[name][1] - offsets[name][0], value(self.layers[name].activator))
+                for name in self.layer_names])[:,np.newaxis]
+        self.mid = per_row(lambda a: (a.on + a.off)/2.)
+        self.half = per_row(lambda a: abs(a.on - a.off)/2.)
+        self.thresholds = per_row(lambda a: a.threshold)
+
+        shape = (len(self.layer_names), activity.batch_size)
+        dtype = np.dtype([("tick", np.int64),
+            ("corrosion", np.float64, shape),
+            ("margin", np.float64, shape),
+            ("near", np.int64, shape)])
+        if self.filename is None:
+            self.records = np.zeros(self.capacity, dtype=dtype)
+        else:
+            self.records = open_memmap(self.filename, mode="w+", dtype=dtype, shape=(self.capacity,))
+        self.records["tick"] = -1
+
+    def observe(self, activity):
+        """Count one tick, and sample the activity buffer if one is due"""
+        self.ticks += 1
+        if self.ticks % self.every == 0: self.sample(activity)
+
+    def sample(self, activity):
+        """Measure every layer of an ActivityBuffer into the next record"""
+        if self.records is None or self.records["corrosion"].shape[2] != activity.batch_size:
+            self._allocate(activity)
+
+        x = activity.data
+        distance = np.fabs(x - self.thresholds)
+        record = self.records[self.count % self.capacity]
+        record["tick"] = self.ticks
+        record["corrosion"] = np.maximum.reduceat(
+            np.fabs(np.fabs(x - self.mid) - self.half), self.starts, axis=0)
+        record["margin"] = np.minimum.reduceat(distance, self.starts, axis=0)
+        record["near"] = np.add.reduceat(distance < self.epsilon, self.starts, axis=0)
+        self.count += 1
+        self._check(record)
+
+    def _check(self, record):
+        # warn when a layer first crosses a limit
+        for metric, limit in self.limits.items():
+            if limit is None: continue
+            for l, name in enumerate(self.layer_names):
+                bound = limit.get(name) if isinstance(limit, dict) else limit
+                if bound is None: continue
+                values = record[metric][l]
+                value = values.min() if metric == "margin" else values.max()
+                bad = value < bound if metric == "margin" else value > bound
+                if bad and (name, metric) not in self.unhealthy:
+                    self.unhealthy.add((name, metric))
+                    self.warnings.append((self.ticks, name, metric, value))
+                    warnings.warn(HealthWarning("tick %d: %s %s is %s (limit %s)"%(
+                        self.ticks, name, metric, value, bound)))
+                elif not bad:
+                    self.unhealthy.discard((name, metric))
+
+    def history(self, layer_name=None):
+        """
+        Samples taken so far, oldest first (at most capacity of them)
+        layer_name: optionally only this layer's metrics, as a dict of arrays
+        """
+        if self.records is None: return None
+        records = np.roll(self.records, -(self.count % self.capacity))
+        records = records[records["tick"] >= 0]
+        if layer_name is None: return records
+        l = self.layer_names.index(layer_name)
+        return {"tick": records["tick"],
+            "corrosion": records["corrosion"][:,l],
+            "margin": records["margin"][:,l],
+            "near": records["near"][:,l]}
@@ -0,0 +1,114 @@
+import numpy as np
+import scipy.linalg as spla
+
+class IncrementalSolver:
+    """
+    Weights w and bias b with w.dot(x) + b = g(y) for a growing (or shrinking)
+    set of (x, y) pairs, the same minimum-norm least squares solution that
+    linear_solve computes from scratch.
+    While the inputs (with a 1 appended for the bias) are linearly
+    independent, the Cholesky factor L of their Gram matrix A.T.dot(A) is
+    kept, and adding or removing k pairs is a rank-k change to the solution,
+    costing O(N^2 k) instead of a new O(N^3) solve. Otherwise (e.g. more
+    pairs than inputs) each change falls back to a full lstsq solve.
+    """
+
+    def __init__(self, num_inputs, num_outputs, tolerance=1e-5):
+        """
+        num_inputs, num_outputs: sizes of the x and y layers
+        tolerance: new inputs whose part outside the span of the current ones
+            is relatively smaller than this count as dependent (the Gram
+            matrix squares rounding errors, so this is well above machine
+            precision)
+        """
+        self.A = np.empty((num_inputs + 1, 0)) # one [x; 1] column per pair
+        self.gY = np.empty((num_outputs, 0)) # one g(y) column per pair
+        self.L = np.empty((0, 0)) # lower Cholesky factor of A.T.dot(A), None if singular
+        self.W = np.zeros((num_outputs, num_inputs + 1)) # [w, b]
+        self.keys = [] # optional label of each pair, e.g. its token
+        self.tolerance = tolerance
+
+    def __len__(self):
+        return self.A.shape[1]
+
+    def weights(self, dtype=np.float64):
+        """Current solution as (w, b)"""
+        return self.W[:,:-1].astype(dtype), self.W[:,[-1]].astype(dtype)
+
+    def add(self, X, gY, keys=None):
+        """
+        Append pairs: X and gY have one x and g(y) column per pair
+        keys: optional list of labels for the pairs
+        """
+        A = np.concatenate((X, np.ones((1, X.shape[1]))), axis=0)
+        self.keys.extend([None]*A.shape[1] if keys is None else keys)
+        if self.L is not None and len(self) + A.shape[1] <= A.shape[0]:
+            # bordered factor: [[L, 0], [B, L22]] with B = (L^-1 A_old.T A).T
+            Bt = spla.solve_triangular(self.L, self.A.T.dot(A), lower=True)
+            S = A.T.dot(A) - Bt.T.dot(Bt) # Gram matrix of A's part outside A_old's span
+            L22 = self._cholesky(S, A)
+            if L22 is not None:
+                # the new pairs only move the solution along that part, Q
+                Q = A - self.A.dot(spla.solve_triangular(self.L, Bt, lower=True, trans='T'))
+                R = gY - self.W.dot(A)
+                self.W += spla.cho_solve((L22, True), R.T).T.dot(Q.T)
+                k = len(self)
+                L = np.zeros((k + A.shape[1], k + A.shape[1]))
+                L[:k,:k], L[k:,:k], L[k:,k:] = self.L, Bt.T, L22
+                self.L = L
+                self.A = np.concatenate((self.A, A), axis=1)
+                self.gY = np.concatenate((self.gY, gY), axis=1)
+                return
+        self.A = np.concatenate((self.A, A), axis=1)
+        self.gY = np.concatenate((self.gY, gY), axis=1)
+        self.L = None
+        self._resolve()
+
+    def remove(self, indices):
+        """Remove the pairs at the given column indices"""
+        indices = np.sort(np.atleast_1d(indices))
+        keep = np.setdiff1d(np.arange(len(self)), indices)
+        if self.L is not None:
+            # Z = K^-1 A.T and C = gY K^-1 are the pairs' parts of the solution
+            E = np.zeros((len(self), len(indices)))
+            E[indices, np.arange(len(indices))] = 1.
+            M = spla.cho_solve((self.L, True), E) # columns of K^-1
+            Z, C = M.T.dot(self.A.T), self.gY.dot(M)
+            self.W -= C.dot(np.linalg.solve(M[indices], Z))
+            for i in indices[::-1]: self.L = _cholesky_delete(self.L, i)
+        self.A, self.gY = self.A[:,keep], self.gY[:,keep]
+        self.keys = [self.keys[k] for k in keep]
+        if self.L is None: self._resolve()
+
+    def _cholesky(self, S, A):
+        # factor of S, None if A's new part is numerically dependent
+        try: L = np.linalg.cholesky(S)
+        except np.linalg.LinAlgError: return None
+        scale = np.sqrt(np.einsum("ij,ij->j", A, A)).max()
+        if np.diag(L).min() < self.tolerance * scale: return None
+        return L
+
+    def _resolve(self):
+        # from scratch, refactoring if possible
+        if len(self) == 0:
+            self.L, self.W[:] = np.empty((0, 0)), 0.
+            return
+        self.L = self._cholesky(self.A.T.dot(self.A), self.A) if len(self) <= self.A.shape[0] else None
+        if self.L is None:
+            self.W = np.linalg.lstsq(self.A.T, self.gY.T, rcond=None)[0].T
+        else:
+            self.W = spla.cho_solve((self.L, True), self.gY.T).T.dot(self.A.T)
+
+def _cholesky_delete(L, i):
+    # Cholesky factor of L.dot(L.T) without row and column i:
+    # the trailing block absorbs the deleted column as a rank-one update
+    x = L[i+1:,i].copy()
+    L = np.delete(np.delete(L, i, axis=0), i, axis=1)
+    T = L[i:,i:]
+    for k in range(T.shape[0]):
+        r = np.hypot(T[k,k], x[k])
+        c, s = r / T[k,k], x[k] / T[k,k]
+        T[k,k] = r
+        T[k+1:,k] = (T[k+1:,k] + s * x[k+1:]) / c
+        x[k+1:] = c * x[k+1:] - s * T[k+1:,k]
+    return L
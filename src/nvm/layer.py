@@ -1,5 +1,6 @@
 import numpy as np
 from orthogonal_patterns import random_orthogonal_patterns
+from coder import seeded_random_state
 # import added for python3
 from functools import reduce
 
@@ -18,15 +19,32 @@ class Layer:
         T = len(tokens)
         if orthogonal:
             on, off = self.activator.on, self.activator.off
-            patterns = random_orthogonal_patterns(self.size, T)
+            if self.coder.seed is None:
+                patterns = random_orthogonal_patterns(self.size, T)
+            else:
+                # seeded: Hadamard columns depend only on the seed and the set
+                # of tokens, assigned to the tokens in sorted order
+                order = sorted(set(tokens))
+                patterns = random_orthogonal_patterns(self.size, len(order),
+                    seeded_random_state(self.coder.seed, "\x00".join(order)))
+                column = {token: c for c, token in enumerate(order)}
+                patterns = patterns[:, [column[token] for token in tokens]]
             patterns = off + (on - off)*(patterns + 1.)/2.
+            patterns = patterns.astype(self.activator.dtype, copy=False)
             for t in range(T):
                 self.coder.encode(tokens[t], patterns[:,[t]])
+        elif T == 0:
+            patterns = np.empty((self.size,0), dtype=self.activator.dtype)
         else:
-            patterns = [np.empty((self.size,0))] # in case of empty token list
-            for t in range(T):
-                patterns.append(self.coder.encode(tokens[t]))
-            patterns = np.concatenate(patterns, axis=1)
+            patterns = self.coder.encode_many(tokens)
         return patterns
+    def encode_tokens_g(self, tokens):
+        """
+        Return activator.g of the patterns encoding a list of tokens, as
+        cached by the coder (targets for the learning rules' gY)
+        """
+        if len(tokens) == 0:
+            return np.empty((self.size,0), dtype=self.activator.dtype)
+        return self.coder.encode_many_g(tokens)
     def all_tokens(self):
         return self.coder.encodings.keys()
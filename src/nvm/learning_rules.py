@@ -1,40 +1,76 @@
 import numpy as np
+import scipy.linalg as spla
 from activator import *
+from low_rank import LowRankMatrix
 
-def linear_solve(w, b, X, Y, actx, acty):
+def linear_solve(w, b, X, Y, actx, acty, gY=None):
+    # gY: acty.g(Y) if already computed (e.g. Coder.encode_many_g)
+    if gY is None: gY = acty.g(Y)
     dwb = np.linalg.lstsq(
-        np.concatenate((X.T, np.ones((X.shape[1],1))), axis=1), # ones for bias
-        acty.g(Y).T, rcond=None)[0].T
+        np.concatenate((X.T, np.ones((X.shape[1],1), dtype=X.dtype)), axis=1), # ones for bias
+        gY.T, rcond=None)[0].T
     dw, db =  dwb[:,:-1], dwb[:,[-1]]
     return dw, db
 
-def hebbian(w, b, X, Y, actx, acty):
+def hebbian(w, b, X, Y, actx, acty, gY=None):
+    if gY is None: gY = acty.g(Y)
     N = X.shape[0]
     alpha = 2./(actx.on - actx.off)
     beta = (alpha * actx.off + 1)
-    one = np.ones(X.shape)
-    dw = acty.g(Y).dot(alpha**2 * X.T - alpha * beta * one.T) / N
-    db = acty.g(Y).dot(- alpha * beta * X.T + beta**2 * one.T).dot(one[:,:1]) / N
+    one = np.ones(X.shape, dtype=X.dtype)
+    if isinstance(w, LowRankMatrix):
+        # one factored term per association
+        dw = LowRankMatrix(w.shape, w.dtype, w.max_rank)
+        dw.add_outer(gY / N, alpha**2 * X - alpha * beta * one)
+    else:
+        dw = gY.dot(alpha**2 * X.T - alpha * beta * one.T) / N
+    db = gY.dot(- alpha * beta * X.T + beta**2 * one.T).dot(one[:,:1]) / N
     return dw, db
 
-def rehebbian(w, b, X, Y, actx, acty):
+def rehebbian(w, b, X, Y, actx, acty, gY=None, batch_size=64):
+    """
+    Sequential delta rule: each (x, y) pair in turn changes w and b along
+    x - c so that w.dot(x) + b reaches g(y).
+    Pairs are processed batch_size at a time (see _rehebbian_changes), which
+    reproduces the one-pair-at-a-time result up to rounding.
+    """
+    if gY is None: gY = acty.g(Y)
+    U, V, db = _rehebbian_changes(w, b, X, gY, actx, np.ones(X.shape[1]), batch_size)
+    if isinstance(w, LowRankMatrix):
+        # accumulated as factors
+        dw = LowRankMatrix(w.shape, w.dtype, w.max_rank)
+        dw.add_outer(U, V)
+    else:
+        dw = U.dot(V.T)
+    return dw, db
 
-    N = X.shape[0]
+def _rehebbian_changes(w, b, X, gY, actx, scales, batch_size):
+    # rehebbian's p^th change, scaled by scales[p], is u_p (x_p - c).T in w
+    # and -u_p sum(x_p - c) c in b, where u_p depends on the earlier changes
+    # only through their responses to x_p:
+    #     N r^2 u_p = g(y_p) - (w x_p + b) - sum_{j<p} u_j H[j,p]
+    #     H[j,p] = scales[j] ((x_j - c).T x_p - c sum(x_j - c))
+    # Within a batch this is a triangular system in the u's, so each batch
+    # costs a few matrix products and one triangular solve.
+    # Returns U (one u per column), V (x - c per column) and the total db.
+    N, P = X.shape
     c = (actx.on + actx.off)/2. # center
     r = (actx.on - actx.off)/2. # radius
-
-    w0, b0 = w, b
-    for p in range(Y.shape[1]):
-        x, y = X[:,[p]], Y[:,[p]]
-        dw = (acty.g(y) - (w.dot(x)+b)) * (x - c).T / (N*r**2)
-        db = - dw.sum(axis=1)[:,np.newaxis] * c
-        w, b = w + dw, b + db
-
-    dw, db = w - w0, b - b0
-    return dw, db
-
-def dipole(w, b, X, Y, actx, acty):
-    # only works for single x, y
+    V = X - c
+    sums = V.sum(axis=0)
+    WXB = w.dot(X) + b # initial response to each x
+    U = np.zeros(gY.shape, dtype=np.result_type(gY, WXB))
+    for start in range(0, P, batch_size):
+        end = min(P, start + batch_size)
+        H = scales[:end, np.newaxis] * (V[:,:end].T.dot(X[:,start:end]) - c * sums[:end, np.newaxis])
+        E = gY[:,start:end] - WXB[:,start:end] - U[:,:start].dot(H[:start])
+        T = np.triu(H[start:], 1) + N*r**2 * np.eye(end - start)
+        U[:,start:end] = spla.solve_triangular(T, E.T, trans='T').T
+    db = - c * (U * scales).dot(sums)[:,np.newaxis]
+    return U, V, db.astype(b.dtype, copy=False)
+
+def dipole(w, b, X, Y, actx, acty, gY=None):
+    # only works for single x, y (gY is accepted but not needed)
     
     # map x, y to [-1,1]
     wx = 2/(actx.on - actx.off)
@@ -50,18 +86,66 @@ def dipole(w, b, X, Y, actx, acty):
 
     # final weights
     N = X.shape[0]
-    one = np.ones((N,1))
+    one = np.ones((N,1), dtype=X.dtype)
     dw = yw*sy*sx.T*wx - w
     db = yw*sy*(sx.T.dot(one)*bx - (N-1)) + yb - b
 
     return dw, db
 
-def learn(w, b, X, Y, actx, acty, learning_rule, verbose=False):
+def sequential_updates(learning_rule, w, b, X, Y, actx, acty, scales, gY=None, batch_size=64):
+    """
+    Total change in w and b from applying learning_rule to the columns of X
+    and Y one at a time, in order, with the p^th change scaled by scales[p]
+    (as consecutive ticks of plasticity would).
+    hebbian and rehebbian are batched into a few matrix products.
+    gY: acty.g(Y) if already computed
+    batch_size: pairs per batch for rehebbian
+    """
+    N = X.shape[0]
+    scales = np.asarray(scales).reshape(1, -1)
+
+    if learning_rule is hebbian:
+        # changes do not depend on w, so they can be summed in any order
+        alpha = 2./(actx.on - actx.off)
+        beta = (alpha * actx.off + 1)
+        one = np.ones(X.shape, dtype=X.dtype)
+        gY = (acty.g(Y) if gY is None else gY) * scales
+        if isinstance(w, LowRankMatrix):
+            dw = LowRankMatrix(w.shape, w.dtype, w.max_rank)
+            dw.add_outer(gY / N, alpha**2 * X - alpha * beta * one)
+        else:
+            dw = gY.dot(alpha**2 * X.T - alpha * beta * one.T) / N
+        db = gY.dot(- alpha * beta * X.T + beta**2 * one.T).dot(one[:,:1]) / N
+        return dw, db
+
+    if learning_rule is rehebbian:
+        # batched as in rehebbian, with the scales in the triangular systems
+        if gY is None: gY = acty.g(Y)
+        U, V, db = _rehebbian_changes(w, b, X, gY, actx, scales[0], batch_size)
+        if isinstance(w, LowRankMatrix):
+            dw = LowRankMatrix(w.shape, w.dtype, w.max_rank)
+            dw.add_outer(U * scales, V)
+        else:
+            dw = (U * scales).dot(V.T)
+        return dw, db
+
+    # other rules are applied one pair at a time
+    w0, b0 = w, b
+    for p in range(X.shape[1]):
+        kwargs = {} if gY is None else {"gY": gY[:,[p]]}
+        dw, db = learning_rule(w, b, X[:,[p]], Y[:,[p]], actx, acty, **kwargs)
+        w, b = w + scales[0,p] * dw, b + scales[0,p] * db
+    return w - w0, b - b0
+
+def learn(w, b, X, Y, actx, acty, learning_rule, verbose=False, gY=None):
+    # w and b keep their dtype, so diff_count reflects storage precision
+    # gY: acty.g(Y) if already computed, passed on to the learning rule
     
     if X.shape[1] > 0:
 
-        dw, db = learning_rule(w, b, X, Y, actx, acty)
-        w, b = w + dw, b + db
+        kwargs = {} if gY is None else {"gY": gY}
+        dw, db = learning_rule(w, b, X, Y, actx, acty, **kwargs)
+        w, b = (w + dw).astype(w.dtype, copy=False), (b + db).astype(b.dtype, copy=False)
     
         _Y = acty.f(w.dot(X) + b)
         diff_count = (np.ones(Y.shape) - acty.e(Y, _Y)).sum()
@@ -70,7 +154,7 @@ def learn(w, b, X, Y, actx, acty, learning_rule, verbose=False):
         if verbose:
             print("Learn residual max: %f"%np.fabs(Y - _Y).max())
             print("Learn residual mad: %f"%np.fabs(Y - _Y).mean())
-            print("Learn diff count: %d"%(diff_count))
+            print("Learn diff count: %d (%s weights)"%(diff_count, w.dtype))
 
     else:
 
@@ -79,6 +163,37 @@ def learn(w, b, X, Y, actx, acty, learning_rule, verbose=False):
     return w, b, diff_count
 
 
+# rules whose changes to each output row depend only on that row's targets,
+# so that pathways from the same inputs can be learned jointly (learn_jointly)
+row_separable = [linear_solve, hebbian, rehebbian]
+
+def learn_jointly(ws, bs, X, Ys, actx, actys, learning_rule, verbose=False, gYs=None):
+    """
+    learn for several pathways with the same inputs X at once: ws, bs, Ys,
+    actys and gYs have one entry per pathway. A row_separable learning_rule
+    is applied once to the stacked targets, which gives each pathway the same
+    weights as learning it alone.
+    Returns lists of w, b and diff_count, one per pathway
+    """
+    if gYs is None: gYs = [acty.g(Y) for acty, Y in zip(actys, Ys)]
+    if X.shape[1] > 0:
+        dw, db = learning_rule(
+            np.concatenate(ws), np.concatenate(bs), X, np.concatenate(Ys),
+            actx, actys[0], gY=np.concatenate(gYs))
+        rows = np.cumsum([0] + [w.shape[0] for w in ws])
+
+    results = ([], [], [])
+    for i in range(len(ws)):
+        # each pathway's rows of the change, with learn's casting and diff count
+        if X.shape[1] > 0:
+            rule = lambda w, b, X, Y, actx, acty, **kwargs: (
+                dw[rows[i]:rows[i+1]], db[rows[i]:rows[i+1]])
+        else: rule = None
+        for result, value in zip(results,
+            learn(ws[i], bs[i], X, Ys[i], actx, actys[i], rule, verbose=verbose)):
+            result.append(value)
+    return results
+
 if __name__ == "__main__":
     
     # # logistic hebbian
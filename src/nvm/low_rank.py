@@ -0,0 +1,68 @@
+import numpy as np
+
+class LowRankMatrix:
+    """
+    Weight matrix stored as accumulated factors U.dot(V.T), one column of U
+    and V per rank-one (Hebbian) association.
+    Products cost O((rows + columns) * rank) instead of O(rows * columns).
+    Adding a dense matrix, or growing past the break-even rank, returns an
+    equivalent dense array instead, so that w += dw densifies automatically.
+    """
+
+    # numpy defers arithmetic with these matrices to the methods below
+    __array_ufunc__ = None
+
+    def __init__(self, shape, dtype=np.float64, max_rank=None):
+        """
+        shape: (rows, columns) of the full matrix
+        max_rank: densify past this rank (default is the break-even rank)
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.U = np.zeros((self.shape[0], 0), dtype=dtype)
+        self.V = np.zeros((self.shape[1], 0), dtype=dtype)
+        if max_rank is None:
+            max_rank = self.shape[0]*self.shape[1] // (self.shape[0]+self.shape[1])
+        self.max_rank = max_rank
+
+    @property
+    def size(self):
+        return self.shape[0]*self.shape[1]
+
+    @property
+    def rank(self):
+        return self.U.shape[1]
+
+    def copy(self):
+        m = LowRankMatrix(self.shape, self.dtype, self.max_rank)
+        m.U, m.V = self.U.copy(), self.V.copy()
+        return m
+
+    def add_outer(self, u, v):
+        """Accumulate u.dot(v.T) in place, u and v have one column per term"""
+        self.U = np.concatenate((self.U, u.astype(self.dtype, copy=False)), axis=1)
+        self.V = np.concatenate((self.V, v.astype(self.dtype, copy=False)), axis=1)
+
+    def dot(self, x, out=None):
+        return self.U.dot(self.V.T.dot(x), out=out)
+
+    def toarray(self):
+        return self.U.dot(self.V.T)
+
+    def __array__(self, dtype=None, copy=None):
+        a = self.toarray()
+        return a if dtype is None else a.astype(dtype)
+
+    def __mul__(self, scale):
+        m = self.copy()
+        m.U *= scale
+        return m
+
+    __rmul__ = __mul__
+
+    def __iadd__(self, other):
+        if not isinstance(other, LowRankMatrix):
+            return (self.toarray() + other).astype(self.dtype, copy=False)
+        self.add_outer(other.U, other.V)
+        if self.rank > self.max_rank: return self.toarray()
+        return self
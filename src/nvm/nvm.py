@@ -6,29 +6,67 @@ from nvm_net import NVMNet
 from preprocessing import *
 from orthogonal_patterns import nearest_valid_hadamard_size
 
+# non-plastic opcodes that step can execute symbolically
+fast_opcodes = ["nop","movv","movd","cmpv","cmpd","jmpv","jmpd","jie"]
+
+# control states that end an instruction cycle in step
+control_states = [("gh", "start"), ("opc", "exit")]
+
 class NVM:
-    def __init__(self, layer_shape, pad, activator, learning_rule, register_names, shapes={}, tokens=[], orthogonal=False, verbose=False):
+    def __init__(self, layer_shape, pad, activator, learning_rule, register_names, shapes={}, tokens=[], orthogonal=False, verbose=False, engine="dict", dtype=np.float64, weight_dtype=None, num_threads=1, parallel_threshold=2**18, low_rank=False, defer_plasticity=False, packed_patterns=False, fast_path=False, fast_corrosion=.1, seed=None, cache=None):
 
         self.tokens = tokens
         self.orthogonal = orthogonal
         self.register_names = register_names
         # default registers
         layer_size = layer_shape[0]*layer_shape[1]
-        act = activator(pad, layer_size)
-        registers = {name: Layer(name, layer_shape, act, Coder(act))
+        act = activator(pad, layer_size, dtype=dtype)
+        registers = {name: Layer(name, layer_shape, act, Coder(act, packed=packed_patterns,
+            seed=None if seed is None else "%s/%s" % (seed, name)))
             for name in register_names}
-        self.net = NVMNet(layer_shape, pad, activator, learning_rule, registers, shapes=shapes, tokens=tokens, orthogonal=orthogonal, verbose=verbose)
+        self.net = NVMNet(layer_shape, pad, activator, learning_rule, registers, shapes=shapes, tokens=tokens, orthogonal=orthogonal, verbose=verbose, engine=engine,
+            dtype=dtype, weight_dtype=weight_dtype,
+            num_threads=num_threads, parallel_threshold=parallel_threshold,
+            low_rank=low_rank, defer_plasticity=defer_plasticity,
+            packed_patterns=packed_patterns, seed=seed, cache=cache)
+
+        # hybrid execution: clean non-plastic instructions skip the neural ticks
+        self.fast_path = fast_path
+        self.fast_corrosion = fast_corrosion
+        self.instruction_counts = {"fast": 0, "neural": 0}
+
+    def assemble(self, programs, verbose=0, other_tokens=[], num_processes=1):
+        self.net.assemble(programs, verbose, self.orthogonal, self.tokens.union(other_tokens),
+            num_processes=num_processes)
+
+    def close(self):
+        """Release the net's threads, see NVMNet.close"""
+        self.net.close()
 
-    def assemble(self, programs, verbose=0, other_tokens=[]):
-        self.net.assemble(programs, verbose, self.orthogonal, self.tokens.union(other_tokens))
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     def load(self, program_name, initial_state):
         self.net.load(program_name, initial_state)
+        self.instruction_counts = {"fast": 0, "neural": 0}
+
+    def load_batch(self, program_names, initial_states):
+        """
+        Load several instances that share these weights and run in lockstep.
+        Afterwards decode_layer, decode_state, at_start, at_exit and step
+        return one result per instance.
+        """
+        self.net.load_batch(program_names, initial_states)
 
     def initialize_memory(self, pointers, values):
         self.net.initialize_memory(pointers, values)
 
     def decode_layer(self, layer_name):
+        if self.net.batch_size is not None:
+            return self.net.decode_columns(layer_name)
         return self.net.layers[layer_name].coder.decode(self.net.activity[layer_name])
 
     def encode_symbol(self, layer_name, symbol):
@@ -36,15 +74,25 @@ class NVM:
         self.net.activity[layer_name] = pattern
 
     def decode_state(self, layer_names=None):
-        if layer_names is None:
-            layer_names = self.net.layers.keys()
-        return {name:
-            self.net.layers[name].coder.decode(
-            self.net.activity[name])
-            for name in layer_names}
+        states = self.net.decode_record(layer_names).as_states()
+        if self.net.batch_size is not None: return states
+        return states[0]
+
+    def decode_record(self, layer_names=None):
+        """
+        Compact decoded state: a StateRecord with one token id and clean flag
+        per layer (and instance), see NVMNet.decode_record.
+        Clean means decodable with corrosion at most fast_corrosion.
+        """
+        return self.net.decode_record(layer_names, tolerance=self.fast_corrosion)
 
     def state_string(self):
-        state = self.decode_state()
+        if self.net.batch_size is not None:
+            return "\n".join([self._state_string(state)
+                for state in self.decode_state()])
+        return self._state_string(self.decode_state())
+
+    def _state_string(self, state):
         return "ip %s: "%state["ip"] + \
             " ".join([
                 "%s"%state[x] for x in ["opc","op1","op2"]]) + ", " + \
@@ -58,19 +106,105 @@ class NVM:
         return self.net.at_exit()
 
     def step(self, verbose=0, max_ticks=50):
-        for t in range(max_ticks):
-            self.net.tick()
+        if self.net.batch_size is not None:
+            return self.step_batch(verbose, max_ticks)
+
+        profiler = self.net.profiler
 
+        if self.fast_path and self.fast_step():
+            self.instruction_counts["fast"] += 1
+            if profiler is not None:
+                profiler.count_instruction(self.decode_layer("opc"), 0)
+            if verbose > 0: print(self.state_string())
+            return True
+        self.instruction_counts["neural"] += 1
+
+        def show():
             if verbose > 1: print(self.state_string())
             elif self.net.at_ready() and verbose > 0: print(self.state_string())
 
-            if self.net.at_start(): return True
-            if self.at_exit(): return True
+        ticks, reached = self.net.run_until(control_states, max_ticks,
+            callback=show if verbose > 0 else None)
+        if reached is not None:
+            if profiler is not None:
+                profiler.count_instruction(self.decode_layer("opc"), ticks)
+            return True
 
         # indicate whether step failed
         return False
 
-def make_default_nvm(register_names, layer_shape=None, orthogonal=False, shapes={}, tokens=[]):
+    def _clean_token(self, layer_name):
+        # decoded token of a layer, or "?" if it is unknown or too corroded
+        layer = self.net.layers[layer_name]
+        pattern = self.net.activity[layer_name]
+        if layer.activator.corrosion(pattern) > self.fast_corrosion: return "?"
+        return layer.coder.decode(pattern)
+
+    def fast_step(self):
+        """
+        Execute the next instruction symbolically, without neural ticks.
+        Only done for non-plastic opcodes at the start of an instruction cycle,
+        when every layer involved decodes cleanly: the post-instruction
+        patterns are set directly from the coders and the assembler's ip table.
+        Returns False (leaving activity untouched) if the instruction must be
+        simulated neurally instead.
+        """
+        if self._clean_token("gh") != "start": return False
+        if self._clean_token("go") != "start": return False
+        ip = self._clean_token("ip")
+        if ip not in self.net.ip_table: return False
+        (opc, op1, op2), next_ip = self.net.ip_table[ip]
+        if opc not in fast_opcodes: return False
+
+        # tokens of the post-instruction state
+        state = {"gh": "start", "go": "start", "ip": next_ip,
+            "opc": opc, "op1": op1, "op2": op2}
+        if opc in ["movv", "movd", "cmpv", "cmpd", "jmpd"]:
+            if op1 not in self.register_names: return False
+        if opc in ["movd", "cmpd"]:
+            if op2 not in self.register_names: return False
+
+        if opc == "movv": state[op1] = op2
+        if opc == "movd": state[op1] = self._clean_token(op2)
+        if opc in ["cmpv", "cmpd"]:
+            a = self._clean_token(op1)
+            b = op2 if opc == "cmpv" else self._clean_token(op2)
+            if a == "?": return False
+            state["ci"] = b
+            state["co"] = "true" if a == b else "false"
+        if opc == "jmpv": state["ip"] = op1
+        if opc == "jmpd": state["ip"] = self._clean_token(op1)
+        if opc == "jie":
+            co = self._clean_token("co")
+            if co not in ["true", "false"]: return False
+            if co == "true": state["ip"] = op1
+
+        # every token must already have a pattern in its layer
+        for name, token in state.items():
+            if token not in self.net.layers[name].coder.encodings: return False
+        for name, token in state.items():
+            self.net.activity[name] = self.net.layers[name].coder.encode(token)
+        return True
+
+    def step_batch(self, verbose=0, max_ticks=50):
+        """
+        Step all batched instances by one instruction in lockstep.
+        Instances that reach the next instruction (or have exited) early are
+        frozen while the rest of the batch catches up.
+        Returns a boolean array indicating which instances did not fail.
+        """
+        finished = self.net.at_exit()
+        ticks, reached = self.net.run_until(control_states, max_ticks,
+            active=~finished,
+            callback=(lambda: print(self.state_string())) if verbose > 1 else None)
+        finished |= reached >= 0
+
+        if verbose == 1: print(self.state_string())
+
+        # indicate which steps failed
+        return finished
+
+def make_default_nvm(register_names, layer_shape=None, orthogonal=False, shapes={}, tokens=[], engine="dict", dtype=np.float64, weight_dtype=None, num_threads=1, parallel_threshold=2**18, low_rank=False, defer_plasticity=False, packed_patterns=False, fast_path=False, seed=None, cache=None):
     # if layer_shape is None: layer_shape = (16,16) if orthogonal else (32,32)
     if layer_shape is None: layer_shape = (12,20) if orthogonal else (32,32) # test non-pow-2 hadamard
     pad = 0.0001
@@ -79,13 +213,31 @@ def make_default_nvm(register_names, layer_shape=None, orthogonal=False, shapes=
 
     return NVM(layer_shape,
         pad, activator, learning_rule, register_names,
-        shapes=shapes, tokens=tokens, orthogonal=orthogonal)
+        shapes=shapes, tokens=tokens, orthogonal=orthogonal, engine=engine,
+        dtype=dtype, weight_dtype=weight_dtype,
+        num_threads=num_threads, parallel_threshold=parallel_threshold,
+        low_rank=low_rank, defer_plasticity=defer_plasticity,
+        packed_patterns=packed_patterns, fast_path=fast_path, seed=seed, cache=cache)
 
-def make_scaled_nvm(register_names, programs, orthogonal=False, capacity_factor=.05, scale_factor=1.0, extra_tokens=[], num_addresses=None, shapes_override={}, verbose=False):
+def make_scaled_nvm(register_names, programs, orthogonal=False, capacity_factor=.05, scale_factor=1.0, extra_tokens=[], num_addresses=None, shapes_override={}, verbose=False, engine="dict", dtype=np.float64, weight_dtype=None, num_threads=1, parallel_threshold=2**18, low_rank=False, defer_plasticity=False, packed_patterns=False, fast_path=False, seed=None, cache=None):
     """
     Create an NVM with auto-scaled layer sizes based on programs that will be learned
     capacity_factor: assumes pattern capacity is at most this fraction of layer size
     scale_factor: scales layer sizes to this amount of what target capacity requires
+    engine: "dict" or "block" execution engine for NVMNet.tick
+    dtype: numeric type of activity and computation (e.g. np.float32)
+    weight_dtype: numeric type of weight storage (defaults to dtype)
+    num_threads: size of the thread pool for NVMNet.tick (1 is serial),
+        stopped by NVM.close
+    parallel_threshold: minimum weight entries in a tick phase to use the pool
+    low_rank: store fast connectivity (memory and stack pathways) as factors
+    defer_plasticity: queue plasticity until a pathway is next read
+    packed_patterns: store token encodings as packed bits in each Coder
+    fast_path: execute clean non-plastic instructions symbolically in step
+    seed: derive every token pattern from (seed, layer name, token), so that
+        the same programs always compile to the same network
+    cache: NetworkCache to reload the constructed and assembled network from
+        instead of recomputing it (seeded networks only)
     """
     
     num_lines, num_patterns, all_tokens = measure_programs(
@@ -117,7 +269,11 @@ def make_scaled_nvm(register_names, programs, orthogonal=False, capacity_factor=
 
     return NVM(layer_shape,
         pad, activator, learning_rule, register_names,
-        shapes=shapes, tokens=all_tokens, orthogonal=orthogonal, verbose=verbose)
+        shapes=shapes, tokens=all_tokens, orthogonal=orthogonal, verbose=verbose,
+        engine=engine, dtype=dtype, weight_dtype=weight_dtype,
+        num_threads=num_threads, parallel_threshold=parallel_threshold,
+        low_rank=low_rank, defer_plasticity=defer_plasticity,
+        packed_patterns=packed_patterns, fast_path=fast_path, seed=seed, cache=cache)
 
 if __name__ == "__main__":
 
@@ -1,3 +1,5 @@
+import mmap
+import multiprocessing as mp
 import numpy as np
 from learning_rules import *
 from preprocessing import preprocess
@@ -5,9 +7,91 @@ from preprocessing import preprocess
 def unique(x):
     return list(set(x))
 
-def assemble(nvmnet, programs, verbose=False, orthogonal=False, other_tokens=[]):
+def learn_job(job, ws, bs, verbose=False):
+    """
+    Run one learning job: (pathways, steps, actx, actys, learning_rule).
+    Each step (X, Ys, gYs) is learned jointly into all of the pathways (see
+    learn_jointly), starting from the previous step's weights.
+    ws and bs hold the initial weights and biases, one per pathway, and are
+    overwritten in place with the learned ones.
+    Returns the total diff count
+    """
+    pathways, steps, actx, actys, learning_rule = job
+    diff_count = 0
+    for X, Ys, gYs in steps:
+        results = learn_jointly(ws, bs, X, Ys, actx, actys, learning_rule, verbose, gYs)
+        for w, b, w_, b_ in zip(ws, bs, results[0], results[1]):
+            w[...], b[...] = w_, b_
+        diff_count += sum(results[2])
+    return diff_count
+
+# (jobs, ws, bs) of run_jobs, inherited by forked pool workers
+_pool_state = None
+
+def _pool_job(j):
+    jobs, ws, bs = _pool_state
+    return j, learn_job(jobs[j], ws[j], bs[j])
+
+def run_jobs(jobs, dtype, num_processes=1, verbose=False):
+    """
+    Run learning jobs (see learn_job) from zero weights and biases.
+    num_processes > 1 runs them on a pool of forked processes: workers
+    inherit the jobs' patterns instead of receiving pickled copies, write
+    weights and biases into one shared memory buffer, and send back only
+    diff counts. Results are merged in job order, so they are the same as
+    a serial run (learning residuals are only printed when serial).
+    Returns dicts of weights and biases by pathway, and the total diff count
+    """
+    parallel = (num_processes > 1 and len(jobs) > 1
+        and "fork" in mp.get_all_start_methods()) # serial where fork is unavailable
+
+    # zero weights and biases, one (rows, columns) pair per pathway
+    shapes = [[((Y.shape[0], steps[0][0].shape[0]), (Y.shape[0], 1)) for Y in steps[0][1]]
+        for (_, steps, _, _, _) in jobs]
+    if parallel:
+        itemsize = np.dtype(dtype).itemsize
+        sizes = [itemsize * int(np.prod(shape)) for job in shapes for pair in job for shape in pair]
+        buffer = mmap.mmap(-1, max(1, sum(sizes))) # anonymous and shared, zero filled
+        offsets = iter(np.cumsum([0] + sizes))
+        zeros = lambda shape: np.ndarray(shape, dtype, buffer=buffer, offset=next(offsets))
+    else:
+        zeros = lambda shape: np.zeros(shape, dtype=dtype)
+    ws, bs = [], []
+    for job in shapes:
+        pairs = [(zeros(w_shape), zeros(b_shape)) for w_shape, b_shape in job]
+        ws.append([w for w, _ in pairs])
+        bs.append([b for _, b in pairs])
+
+    if parallel:
+        # largest jobs first, for balance
+        costs = [sum(X.size * sum(Y.shape[0] for Y in Ys) for (X, Ys, _) in steps)
+            for (_, steps, _, _, _) in jobs]
+        order = sorted(range(len(jobs)), key=lambda j: -costs[j])
+        global _pool_state
+        _pool_state = (jobs, ws, bs)
+        try:
+            with mp.get_context("fork").Pool(min(num_processes, len(jobs))) as pool:
+                diff_counts = dict(pool.imap_unordered(_pool_job, order))
+        finally:
+            _pool_state = None
+        diff_counts = [diff_counts[j] for j in range(len(jobs))]
+        # copied out of the shared buffer
+        ws = [[w.copy() for w in job] for job in ws]
+        bs = [[b.copy() for b in job] for job in bs]
+    else:
+        diff_counts = [learn_job(job, w, b, verbose) for job, w, b in zip(jobs, ws, bs)]
+
+    weights, biases = {}, {}
+    for job, job_ws, job_bs in zip(jobs, ws, bs):
+        for pathway, w, b in zip(job[0], job_ws, job_bs):
+            weights[pathway], biases[pathway] = w, b
+    return weights, biases, sum(diff_counts)
+
+def assemble(nvmnet, programs, verbose=False, orthogonal=False, other_tokens=[], num_processes=1):
+    # num_processes > 1 learns independent pathways in parallel (see run_jobs)
 
     registers = nvmnet.registers.keys()
+    dtype = nvmnet.weight_dtype
 
     ### Preprocess program strings
     lines, labels, tokens = preprocess(programs, registers)
@@ -31,40 +115,48 @@ def assemble(nvmnet, programs, verbose=False, orthogonal=False, other_tokens=[])
             nvmnet.layers["ip"].coder.encode(label,
                 ip_patterns[:,[name_offsets[name]+line_index]])
 
+    ### Record each ip's instruction and successor, for symbolic execution
+    for name in lines:
+        offset = name_offsets[name]
+        for l, line in enumerate(lines[name]):
+            nvmnet.ip_table[ip_tokens[offset + l]] = (
+                tuple(line), ip_tokens[offset + l + 1])
+        for label, line_index in labels[name].items():
+            nvmnet.ip_table[label] = nvmnet.ip_table[ip_tokens[offset + line_index]]
+
     ### Track total number of errors
     weights, biases = {}, {}
     diff_count = 0
 
+    ### Learning jobs, run once all are set up
+    jobs = []
+
     ### Sequence ip
     if verbose: print("Sequencing ip -> ip")
-    weights[("ip","ip")], biases[("ip","ip")], dc = learn(
-        np.zeros((ip_patterns.shape[0], ip_patterns.shape[0])),
-        np.zeros((ip_patterns.shape[0], 1)),
-        ip_patterns[:,:-1], ip_patterns[:,1:],
-        nvmnet.layers["ip"].activator,
+    jobs.append(([("ip","ip")],
+        [(ip_patterns[:,:-1], [ip_patterns[:,1:]],
+            # orthogonal patterns are fresh on re-assembly, not the coder's
+            [nvmnet.layers["ip"].activator.g(ip_patterns[:,1:])])],
         nvmnet.layers["ip"].activator,
-        nvmnet.learning_rules[("ip","ip")],
-        verbose=verbose)
-    diff_count += dc
+        [nvmnet.layers["ip"].activator],
+        nvmnet.learning_rules[("ip","ip")]))
     
-    ### Link instructions to ip
+    ### Link instructions to ip, one program after another
     for i,x in enumerate("c12"):
         if verbose: print("Linking ip -> op"+x)
-        weights[("op"+x,"ip")] = np.zeros((nvmnet.layers["op"+x].size, nvmnet.layers["ip"].size))
-        biases[("op"+x,"ip")] = np.zeros((nvmnet.layers["op"+x].size, 1))
+        steps = []
         for name in programs:
-            encodings = nvmnet.layers["op"+x].encode_tokens(
-                [line[i] for line in lines[name]])
+            op_tokens = [line[i] for line in lines[name]]
+            encodings = nvmnet.layers["op"+x].encode_tokens(op_tokens)
             ip_patterns = nvmnet.layers["ip"].encode_tokens(
                 ip_tokens[name_offsets[name]:name_offsets[name]+len(lines[name])])
-            weights[("op"+x,"ip")], biases[("op"+x,"ip")], dc = learn(
-                weights[("op"+x,"ip")], biases[("op"+x,"ip")],
-                ip_patterns, encodings,
-                nvmnet.layers["ip"].activator,
-                nvmnet.layers["op"+x].activator,
-                nvmnet.learning_rules[("op"+x,"ip")],
-                verbose=verbose)
-            diff_count += dc
+            steps.append((ip_patterns, [encodings],
+                [nvmnet.layers["op"+x].encode_tokens_g(op_tokens)]))
+        if len(steps) == 0: continue
+        jobs.append(([("op"+x,"ip")], steps,
+            nvmnet.layers["ip"].activator,
+            [nvmnet.layers["op"+x].activator],
+            nvmnet.learning_rules[("op"+x,"ip")]))
 
     ### Link tokens across pathways
     pathways = [(r1, r2) for r1 in registers for r2 in registers] # for movd
@@ -74,27 +166,62 @@ def assemble(nvmnet, programs, verbose=False, orthogonal=False, other_tokens=[])
     pathways += [("ip", r) for r in registers] # jmpd, subd
     pathways += [("ip", "op1")] # for jmpv, subv
 
+    # pathways with the same inputs and a row-separable rule are learned jointly
+    groups = {} # (from name, tokens, rule) -> [(pathway, tokens)]
     for pathway in pathways:
     
         # Set up training data
         to_name, from_name = pathway
-        if verbose: print("Linking %s -> %s"%(from_name, to_name))
         to_layer = nvmnet.layers[to_name]
         from_layer = nvmnet.layers[from_name]
         common_tokens = list(
             set(to_layer.all_tokens()) & set(from_layer.all_tokens()))
+        if to_layer.coder.seed is not None: common_tokens.sort() # reproducible
+
+        # linear_solve pathways only add tokens new since the last assembly
+        if nvmnet.learning_rules[pathway] is linear_solve:
+            if verbose: print("Linking %s -> %s"%(from_name, to_name))
+            X = from_layer.encode_tokens(common_tokens)
+            Y = to_layer.encode_tokens(common_tokens)
+            solver = nvmnet.get_solver(pathway)
+            learned = set(solver.keys)
+            new_tokens = [token for token in common_tokens if token not in learned]
+            w0, b0 = solver.weights(dtype)
+            if len(new_tokens) > 0:
+                solver.add(from_layer.encode_tokens(new_tokens),
+                    to_layer.encode_tokens_g(new_tokens), new_tokens)
+            w, b = solver.weights(dtype)
+            weights[pathway], biases[pathway] = w - w0, b - b0 # added by NVMNet.assemble
+            _Y = to_layer.activator.f(w.dot(X) + b)
+            diff_count += (np.ones(Y.shape) - to_layer.activator.e(Y, _Y)).sum()
+            continue
+
+        rule = nvmnet.learning_rules[pathway]
+        key = (from_name, frozenset(common_tokens), rule) if rule in row_separable else pathway
+        groups.setdefault(key, []).append((pathway, common_tokens))
+
+    for group in groups.values():
+
+        # same input patterns for the whole group, in the first pathway's token order
+        (_, from_name), common_tokens = group[0]
+        from_layer = nvmnet.layers[from_name]
+        to_layers = [nvmnet.layers[to_name] for ((to_name, _), _) in group]
         X = from_layer.encode_tokens(common_tokens)
-        Y = to_layer.encode_tokens(common_tokens)
-        
-        # Learn associations
-        weights[pathway], biases[pathway], dc = learn(
-            np.zeros((to_layer.size, from_layer.size)),
-            np.zeros((to_layer.size, 1)),
-            X, Y, from_layer.activator, to_layer.activator,
-            nvmnet.learning_rules[pathway],
-            verbose=verbose)
-        diff_count += dc
-        
+        if verbose:
+            for to_layer in to_layers: print("Linking %s -> %s"%(from_name, to_layer.name))
+
+        jobs.append(([pathway for (pathway, _) in group],
+            [(X, [to_layer.encode_tokens(common_tokens) for to_layer in to_layers],
+                [to_layer.encode_tokens_g(common_tokens) for to_layer in to_layers])],
+            from_layer.activator, [to_layer.activator for to_layer in to_layers],
+            nvmnet.learning_rules[group[0][0]]))
+
+    ### Learn associations
+    learned_weights, learned_biases, dc = run_jobs(jobs, dtype, num_processes, verbose)
+    weights.update(learned_weights)
+    biases.update(learned_biases)
+    diff_count += dc
+
     return weights, biases, diff_count
     
 if __name__ == '__main__':
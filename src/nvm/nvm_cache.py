@@ -0,0 +1,105 @@
+import os
+import glob
+import pickle
+import hashlib
+import tempfile
+import numpy as np
+
+def describe(value):
+    """
+    Canonical string for hashing: functions by qualified name, containers
+    with sorted keys or items where order does not matter
+    """
+    if isinstance(value, dict):
+        return "{%s}" % ",".join(sorted(
+            "%s:%s" % (describe(k), describe(v)) for k, v in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return "{%s}" % ",".join(sorted(describe(v) for v in value))
+    if isinstance(value, (list, tuple)):
+        return "(%s)" % ",".join(describe(v) for v in value)
+    if isinstance(value, type) or callable(value):
+        return "%s.%s" % (value.__module__, getattr(value, "__qualname__", value.__name__))
+    if isinstance(value, np.dtype): return "dtype(%s)" % value.str
+    return repr(value)
+
+def network_key(*parts):
+    """Hex digest identifying everything that determines a network's state"""
+    return hashlib.sha256(describe(parts).encode("utf-8")).hexdigest()
+
+class NetworkCache:
+    """
+    Content-addressed on-disk cache of network states (see NVMNet.get_state),
+    so that constructing and assembling the same network again is a load.
+    Each state is one pickle file named by its key (see network_key).
+    Least recently used files are evicted once all of them together exceed
+    max_bytes.
+    """
+
+    def __init__(self, directory=None, max_bytes=2**30, bypass=None):
+        """
+        directory: where states are stored (default $NVM_CACHE_DIR or ~/.cache/nvm)
+        max_bytes: total size of the stored states
+        bypass: always recompute, only storing the results (default true if
+            $NVM_CACHE_BYPASS is set to anything but 0)
+        """
+        if directory is None:
+            directory = os.environ.get("NVM_CACHE_DIR",
+                os.path.join(os.path.expanduser("~"), ".cache", "nvm"))
+        if bypass is None:
+            bypass = os.environ.get("NVM_CACHE_BYPASS", "0") not in ["", "0"]
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.bypass = bypass
+        self.hits, self.misses = 0, 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".pkl")
+
+    def load(self, key):
+        """Return the state stored for key, or None"""
+        path = self.path(key)
+        if self.bypass or not os.path.exists(path):
+            self.misses += 1
+            return None
+        try:
+            with open(path, "rb") as f: state = pickle.load(f)
+        except Exception:
+            # truncated or stale file, recomputed and stored again
+            self.misses += 1
+            return None
+        os.utime(path) # most recently used
+        self.hits += 1
+        return state
+
+    def store(self, key, state):
+        """Store a state for key, then evict down to max_bytes"""
+        if not os.path.isdir(self.directory): os.makedirs(self.directory)
+        # written under a temporary name, so readers never see partial files
+        fd, temp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, self.path(key))
+        self.evict()
+
+    def entries(self):
+        """(modification time, size, path) of every stored state, oldest first"""
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, "*.pkl")):
+            try: stat = os.stat(path)
+            except OSError: continue # evicted concurrently
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def evict(self):
+        """Remove least recently used states until the rest fit in max_bytes"""
+        entries = self.entries()
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, path) in entries:
+            if total <= self.max_bytes: break
+            try: os.remove(path)
+            except OSError: pass
+            total -= size
+
+    def clear(self):
+        """Remove every stored state"""
+        for (_, _, path) in self.entries(): os.remove(path)
@@ -1,7 +1,18 @@
+import time
 import numpy as np
 from layer import Layer
 from coder import Coder
 from gate_map import make_nvm_gate_map
+from tick_plan import TickPlan
+from block_engine import BlockEngine
+from activity_buffer import ActivityBuffer
+from state_decoder import StateDecoder
+from low_rank import LowRankMatrix
+from incremental_solver import IncrementalSolver
+from nvm_cache import network_key
+from tick_profiler import TickProfiler
+from health_monitor import HealthMonitor
+from multiprocessing.pool import ThreadPool
 from activator import *
 from learning_rules import *
 from nvm_instruction_set import opcodes, flash_instruction_set
@@ -14,53 +25,69 @@ def update_add(accumulator, summand):
             accumulator[k] += v
         else: accumulator[k] = v
 
-def address_space(forward_layer, backward_layer, pointer_layer=None, orthogonal=False):
-    # set up memory address space
+def address_pathways(forward_layer, backward_layer, pointer_layer=None):
+    # (pathway, to direction, from direction) of each address space pathway
     layers = {'f': forward_layer, 'b': backward_layer}
+    directions = [(d_to, d_from) for d_to in ['f','b'] for d_from in ['f','b']]
     if pointer_layer is not None:
         layers['p'] = pointer_layer
+        directions += [('f','p'),('b','p'),('p','b')]
+    return [((layers[d_to].name, layers[d_from].name), d_to, d_from)
+        for d_to, d_from in directions]
+
+def address_pairs(forward_layer, backward_layer, pointer_layer=None):
+    # pathway -> (X, gY, tokens) linear_solve'd by each address space
+    # pathway, from the already encoded address tokens
+    layers = {'f': forward_layer, 'b': backward_layer, 'p': pointer_layer}
+    tokens = [str(a) for a in range(forward_layer.size)]
+    pairs = {}
+    for key, d_to, d_from in address_pathways(forward_layer, backward_layer, pointer_layer):
+        X = layers[d_from].encode_tokens(tokens)
+        gY = layers[d_to].encode_tokens_g(tokens)
+        # forward and backward steps relate neighboring addresses
+        if 'p' not in (d_to, d_from):
+            if d_from == 'f': X = np.roll(X, 1, axis=1)
+            if d_from == 'b': gY = np.roll(gY, 1, axis=1)
+        pairs[key] = (X, gY, tokens)
+    return pairs
 
-    N = layers['f'].size
-    A = {}
-    for d in layers.keys():
-        A[d] = layers[d].encode_tokens(
-            tokens = [str(a) for a in range(N)],
-            orthogonal=orthogonal)
+def address_space(forward_layer, backward_layer, pointer_layer=None, orthogonal=False, dtype=np.float64):
+    # set up memory address space
+    tokens = [str(a) for a in range(forward_layer.size)]
+    for layer in [forward_layer, backward_layer, pointer_layer]:
+        if layer is not None: layer.encode_tokens(tokens=tokens, orthogonal=orthogonal)
 
+    # linear_solve solutions; the O(N^2) solvers are not kept, see NVMNet.get_solver
+    N = forward_layer.size
     weights, biases = {}, {}
-
-    # Set up forward-backward and recurrent matrices
-    for d_to in ['f','b']:
-        for d_from in ['f','b']:
-            key = (layers[d_to].name, layers[d_from].name)
-            Y, X = A[d_to], A[d_from]
-            if d_from == 'f': X = np.roll(X, 1, axis=1)
-            if d_from == 'b': Y = np.roll(Y, 1, axis=1)
-            weights[key], biases[key], _ = learn(
-                np.zeros((N, N)), np.zeros((N, 1)),
-                X, Y,
-                layers[d_from].activator,
-                layers[d_to].activator,
-                linear_solve, verbose=False)
-
-    # Set up pointer matrices
-    if pointer_layer is not None:
-        for d_to,d_from in [('f','p'),('b','p'),('p','b')]:
-            key = (layers[d_to].name, layers[d_from].name)
-            Y, X = A[d_to], A[d_from]
-            weights[key], biases[key], _ = learn(
-                np.zeros((N, N)), np.zeros((N, 1)),
-                X, Y,
-                layers[d_from].activator,
-                layers[d_to].activator,
-                linear_solve, verbose=False)
+    for key, (X, gY, keys) in address_pairs(forward_layer, backward_layer, pointer_layer).items():
+        solver = IncrementalSolver(N, N)
+        solver.add(X, gY, keys)
+        weights[key], biases[key] = solver.weights(dtype)
 
     return weights, biases
 
 class NVMNet:
     # changing devices to registers
-    def __init__(self, layer_shape, pad, activator, learning_rule, registers, shapes={}, tokens=[], orthogonal=False, verbose=False):
+    def __init__(self, layer_shape, pad, activator, learning_rule, registers, shapes={}, tokens=[], orthogonal=False, verbose=False, engine="dict", dtype=np.float64, weight_dtype=None, num_threads=1, parallel_threshold=2**18, low_rank=False, defer_plasticity=False, packed_patterns=False, seed=None, cache=None):
         # layer_shape is default, shapes[layer_name] are overrides
+        # engine is "dict" (one product per pathway) or "block" (packed per target layer)
+        # dtype is used for activity and computation (float64 or float32)
+        # weight_dtype is used for weight storage (default dtype, may be float16);
+        # lower precision weights are multiplied as cached copies in dtype
+        # num_threads > 1 runs tick on a thread pool, once the weights involved
+        # in a tick phase have at least parallel_threshold entries
+        # low_rank stores fast connectivity as factors until densified
+        # defer_plasticity queues learning until the pathway is next read
+        # packed_patterns stores token encodings as packed bits (see Coder)
+        # seed makes every layer's patterns depend only on (seed, layer, token)
+        # cache (a NetworkCache) stores and reloads constructed and assembled
+        # states; only seeded nets are cached, unseeded ones are new draws
+        if engine not in ["dict", "block"]:
+            raise Exception("Unknown engine %s"%engine)
+        self.engine = engine
+        self.dtype = dtype
+        self.weight_dtype = dtype if weight_dtype is None else weight_dtype
         if 'gh' not in shapes: shapes['gh'] = (32,32) # important for many registers
         if 'm' not in shapes: shapes['m'] = (16,16)
         if 's' not in shapes: shapes['s'] = (8,8)
@@ -68,28 +95,34 @@ class NVMNet:
         # Save padding
         self.pad = pad
 
+        # per layer coders, seeded with the layer name if seed is given
+        def coder(name, act):
+            return Coder(act, packed=packed_patterns,
+                seed=None if seed is None else "%s/%s" % (seed, name))
+        self.seed = seed
+
         # set up instruction layers
         layers = {}
         for name in ['ip','opc','op1','op2']:
             shape = shapes.get(name, layer_shape)
-            act = activator(pad, shape[0]*shape[1])
-            layers[name] = Layer(name, shape, act, Coder(act))
+            act = activator(pad, shape[0]*shape[1], dtype=dtype)
+            layers[name] = Layer(name, shape, act, coder(name, act))
 
         # set up memory and stack layers
         NM, NS = shapes['m'][0]*shapes['m'][1], shapes['s'][0]*shapes['s'][1]
-        actm, acts = activator(pad, NM), activator(pad, NS)
-        for m in ['mf','mb','mp']: layers[m] = Layer(m, shapes['m'], actm, Coder(actm))
-        for s in ['sf','sb']:      layers[s] = Layer(s, shapes['s'], acts, Coder(acts))
+        actm, acts = activator(pad, NM, dtype=dtype), activator(pad, NS, dtype=dtype)
+        for m in ['mf','mb','mp']: layers[m] = Layer(m, shapes['m'], actm, coder(m, actm))
+        for s in ['sf','sb']:      layers[s] = Layer(s, shapes['s'], acts, coder(s, acts))
 
         # set up comparison layers
         c_shape = shapes.get('c', layer_shape)
         NC = c_shape[0]*c_shape[1]
-        actc = activator(pad, NC)
-        for c in ['ci','co']: layers[c] = Layer(c, c_shape, actc, Coder(actc))
+        actc = activator(pad, NC, dtype=dtype)
+        for c in ['ci','co']: layers[c] = Layer(c, c_shape, actc, coder(c, actc))
         co_true = layers['co'].coder.encode('true')
         layers['co'].coder.encode('false', np.array([
             [actc.on if tf == actc.off else actc.off]
-            for tf in co_true.flatten()]))
+            for tf in co_true.flatten()], dtype=dtype))
 
         # add register layers
         layers.update(registers)
@@ -100,10 +133,10 @@ class NVMNet:
         NL = len(layers) + 2 # +2 for gate out/hidden
         NG = NL + 2*NL**2 # number of gates (d + u + l)
         NH = shapes['gh'][0]*shapes['gh'][1] # number of hidden units
-        acto = gate_activator(pad,NG)
-        acth = activator(pad,NH)
-        layers['go'] = Layer('go', (1,NG), acto, Coder(acto))
-        layers['gh'] = Layer('gh', shapes['gh'], acth, Coder(acth))
+        acto = gate_activator(pad,NG, dtype=dtype)
+        acth = activator(pad,NH, dtype=dtype)
+        layers['go'] = Layer('go', (1,NG), acto, coder('go', acto))
+        layers['gh'] = Layer('gh', shapes['gh'], acth, coder('gh', acth))
         self.gate_map = make_nvm_gate_map(layers.keys())        
 
         # set up gain
@@ -111,6 +144,15 @@ class NVMNet:
         for layer_name, layer in layers.items():
             self.w_gain[layer_name], self.b_gain[layer_name] = layer.activator.gain()
 
+        # previously constructed state, restored below
+        self.cache = cache if seed is not None else None
+        self.cache_key, state = None, None
+        if self.cache is not None:
+            self.cache_key = network_key("NVMNet", layer_shape, pad, activator, learning_rule,
+                {name: (layer.shape, layer.activator.label) for name, layer in registers.items()},
+                shapes, tokens, orthogonal, dtype, self.weight_dtype, low_rank, packed_patterns, seed)
+            state = self.cache.load(self.cache_key)
+
         # encode tokens
         self.orthogonal = orthogonal
         self.layers["opc"].encode_tokens(opcodes, orthogonal=orthogonal)
@@ -119,16 +161,20 @@ class NVMNet:
         for name in list(self.registers.keys()) + ["op1","op2","ci"]:
             self.layers[name].encode_tokens(all_tokens, orthogonal=orthogonal)
 
-        # set up connection matrices
-        self.weights, self.biases = flash_instruction_set(self, verbose=verbose)
-
-        ptr_layers = {'m': layers['mp'], 's': None}
-        for ms in 'ms':
-            ms_weights, ms_biases = address_space(
-                layers[ms+'f'], layers[ms+'b'], ptr_layers[ms],
-                orthogonal=orthogonal)
-            self.weights.update(ms_weights)
-            self.biases.update(ms_biases)
+        # pathway -> IncrementalSolver of linear_solve pathways, see get_solver
+        self.solvers = {}
+
+        # set up connection matrices, unless restored below
+        self.weights, self.biases = {}, {}
+        if state is None:
+            self.weights, self.biases = flash_instruction_set(self, verbose=verbose)
+            ptr_layers = {'m': layers['mp'], 's': None}
+            for ms in 'ms':
+                ms_weights, ms_biases = address_space(
+                    layers[ms+'f'], layers[ms+'b'], ptr_layers[ms],
+                    orthogonal=orthogonal, dtype=self.weight_dtype)
+                self.weights.update(ms_weights)
+                self.biases.update(ms_biases)
 
         # initialize fast connectivity
         # changing devices to registers
@@ -140,11 +186,16 @@ class NVMNet:
             [('ip','sf')] + \
             [('co','ci')] + \
             [('mp','mf')]
+        self.plastic_pathways = connect_pairs
         for (to_name, from_name) in connect_pairs:
             N_to = self.layers[to_name].size
             N_from = self.layers[from_name].size
-            self.weights[(to_name, from_name)] = np.zeros((N_to, N_from))
-            self.biases[(to_name, from_name)] = np.zeros((N_to, 1))
+            # dipole learning resets co <- ci to a new full matrix each time
+            if low_rank and (to_name, from_name) != ('co','ci'):
+                self.weights[(to_name, from_name)] = LowRankMatrix((N_to, N_from), dtype=self.weight_dtype)
+            else:
+                self.weights[(to_name, from_name)] = np.zeros((N_to, N_from), dtype=self.weight_dtype)
+            self.biases[(to_name, from_name)] = np.zeros((N_to, 1), dtype=self.weight_dtype)
 
         # initialize learning
         self.learning_rules = {
@@ -160,56 +211,328 @@ class NVMNet:
             self.layers['ci'].activator, self.layers['co'].activator)
         self.biases[('co','ci')] += db
 
+        # store weights at the requested precision, except into the gate hidden
+        # layer: its flashed recurrent solution is ill-conditioned and drifts
+        # when accumulated in single precision, so it stays in double
+        for key in self.weights:
+            dtype = np.float64 if key[0] == 'gh' else self.weight_dtype
+            if isinstance(self.weights[key], np.ndarray):
+                self.weights[key] = self.weights[key].astype(dtype, copy=False)
+            self.biases[key] = self.biases[key].astype(dtype, copy=False)
+
+        # pathway -> queued (x, y, scale) plasticity, see flush_plasticity
+        self.defer_plasticity = defer_plasticity
+        self.max_deferred = 64 # flush a pathway once this many are queued
+        self.deferred = {}
+
+        # tick instrumentation, see start_profiling and start_monitoring
+        self.profiler = None
+        self.monitor = None
+
+        # ip token -> ((opc, op1, op2), next ip token), filled by assembly
+        self.ip_table = {}
+
+        # layer names -> StateDecoder, see decode_record
+        self.state_decoders = {}
+
+        # control states -> probe vectors, see get_probes
+        self.probes = {}
+
+        # gate indices for tick, compiled after assembly
+        self.tick_plan = None
+
+        # restore or record the constructed state
+        if state is not None: self.set_state(state)
+        elif self.cache is not None: self.cache.store(self.cache_key, self.get_state())
+
+        # compute dtype copies of lower precision weights, see _compute_weights
+        self.compute_weights = {}
+
+        # packed weights for the block engine, rebuilt after assembly
+        self.block_engine = None
+        if self.engine == "block": self.pack_weights()
+
+        # thread pool for tick, started on first use
+        self.num_threads = num_threads
+        self.parallel_threshold = parallel_threshold
+        self.thread_pool = None
+
+        # unbatched until load_batch
+        self.batch_size = None
+        self.batch_weights, self.batch_biases = {}, {}
+
+    def compile_tick_plan(self):
+        """Precompute gate indices of every pathway and layer for tick"""
+        self.tick_plan = TickPlan(self.gate_map,
+            self.weights.keys(), self.layers.keys())
+        return self.tick_plan
+
+    def get_tick_plan(self):
+        """Return the tick plan, recompiling if pathways were added"""
+        if self.tick_plan is None or self.tick_plan.is_stale(self.weights):
+            self.compile_tick_plan()
+        return self.tick_plan
+
+    def start_profiling(self):
+        """Start recording tick counters and timings in a new TickProfiler"""
+        self.profiler = TickProfiler()
+        return self.profiler
+
+    def stop_profiling(self):
+        """Stop recording, returning the profiler with the counters so far"""
+        profiler, self.profiler = self.profiler, None
+        return profiler
+
+    def start_monitoring(self, every=1, **kwargs):
+        """
+        Start sampling the health of the activity every few ticks in a new
+        HealthMonitor (see it for the keyword arguments)
+        """
+        self.monitor = HealthMonitor(self.layers, every=every, **kwargs)
+        return self.monitor
+
+    def stop_monitoring(self):
+        """Stop sampling, returning the monitor with the samples so far"""
+        monitor, self.monitor = self.monitor, None
+        return monitor
+
+    def flush_plasticity(self, pathways=None):
+        """
+        Apply queued plasticity, as one batched update per pathway.
+        Call before reading self.weights or self.biases directly.
+        pathways: only flush these (default all)
+        """
+        if pathways is None: pathways = list(self.deferred.keys())
+        for pair_key in pathways:
+            queue = self.deferred.pop(pair_key, None)
+            if queue is None: continue
+            (to_layer, from_layer) = pair_key
+            X, Y, scales = zip(*queue)
+            dw, db = sequential_updates(
+                self.learning_rules[pair_key],
+                self.weights[pair_key],
+                self.biases[pair_key],
+                np.concatenate(X, axis=1),
+                np.concatenate(Y, axis=1),
+                self.layers[from_layer].activator,
+                self.layers[to_layer].activator,
+                scales)
+            self.weights[pair_key] += dw
+            self.biases[pair_key] += db
+            self._weights_changed([pair_key])
+
+    def pack_weights(self):
+        """Pack weights into per-target-layer blocks for the block engine"""
+        self.flush_plasticity()
+        self.block_engine = BlockEngine(
+            self.weights, self.biases, self.layers, dtype=self.dtype)
+        return self.block_engine
+
+    def get_solver(self, pair_key):
+        """
+        IncrementalSolver holding the linear_solve associations of a pathway
+        (created empty if there are none yet), for adding or removing pairs
+        without re-solving, e.g. when the vocabulary grows.
+        Address space solvers are O(N^2) each and only built on first use.
+        """
+        if pair_key not in self.solvers:
+            to_layer, from_layer = pair_key
+            solver = IncrementalSolver(
+                self.layers[from_layer].size, self.layers[to_layer].size)
+            # not kept by address_space, so solve again
+            spaces = self.address_spaces()
+            if pair_key in spaces:
+                solver.add(*address_pairs(*spaces[pair_key])[pair_key])
+            self.solvers[pair_key] = solver
+        return self.solvers[pair_key]
+
+    def address_spaces(self):
+        """
+        Address space pathway -> (forward, backward, pointer) layers of the
+        memory or stack address space it belongs to
+        """
+        spaces = {}
+        for space in [
+            (self.layers['mf'], self.layers['mb'], self.layers['mp']),
+            (self.layers['sf'], self.layers['sb'], None)]:
+            for key, _, _ in address_pathways(*space): spaces[key] = space
+        return spaces
+
+    def get_state(self):
+        """
+        Everything construction and assembly learn, as a picklable dict:
+        weights, biases, coder tables, linear_solve solvers and the ip table
+        """
+        self.flush_plasticity()
+        return {"weights": self.weights, "biases": self.biases,
+            "coders": {name: layer.coder.get_tables() for name, layer in self.layers.items()},
+            # address space solvers are rebuilt by get_solver instead
+            "solvers": {key: solver for key, solver in self.solvers.items()
+                if key not in self.address_spaces()},
+            "ip_table": self.ip_table}
+
+    def set_state(self, state):
+        """Replace the learned state with one from get_state"""
+        self.weights, self.biases = state["weights"], state["biases"]
+        for name, tables in state["coders"].items():
+            self.layers[name].coder.set_tables(tables)
+        self.solvers, self.ip_table = state["solvers"], state["ip_table"]
+        self.deferred = {}
+
+        # derived from the old state, rebuilt on demand
+        self.state_decoders, self.probes = {}, {}
+        self.tick_plan, self.block_engine = None, None
+        self.compute_weights = {}
+
+    def get_block_engine(self, pathways=None):
+        """Return the block engine, repacking if weights were replaced"""
+        if self.block_engine is None or self.block_engine.is_stale(
+            self.weights, self.biases, pathways):
+            self.pack_weights()
+        return self.block_engine
+
     def set_pattern(self, layer_name, pattern):
         self.activity[layer_name] = pattern
 
     def get_open_gates(self):
         pattern = self.activity['go']
         a = self.layers['go'].activator
-        open_gates = []
-        for k in self.gate_map.gate_keys:
-            g = self.gate_map.get_gate_value(k, pattern)
-            if np.fabs(g - a.on) < np.fabs(g - a.off):
-                open_gates.append(k)
-        return open_gates
-
-    def assemble(self, programs, verbose=0, orthogonal=False, other_tokens=[]):
-        weights, biases, diff_count = assemble(self,
-            programs, verbose=(verbose > 1),
-            orthogonal=orthogonal, other_tokens=other_tokens)
+        return [self.gate_map.gate_keys[i]
+            for i in self.gate_map.get_open_indices(pattern, a.on, a.off)]
+
+    def assemble(self, programs, verbose=0, orthogonal=False, other_tokens=[], num_processes=1):
+        # num_processes > 1 learns pathways on a process pool (see run_jobs)
+        self.flush_plasticity()
+
+        # cached while the net has only been constructed and assembled
+        state = None
+        if self.cache_key is not None:
+            self.cache_key = network_key(self.cache_key, "assemble",
+                programs, orthogonal, other_tokens,
+                {name: set(layer.coder.list_tokens()) for name, layer in self.layers.items()})
+            state = self.cache.load(self.cache_key)
+
+        if state is None:
+            weights, biases, diff_count = assemble(self,
+                programs, verbose=(verbose > 1),
+                orthogonal=orthogonal, other_tokens=other_tokens,
+                num_processes=num_processes)
+            update_add(self.weights, weights)
+            update_add(self.biases, biases)
+            if self.cache_key is not None:
+                state = self.get_state()
+                state["diff_count"] = diff_count
+                self.cache.store(self.cache_key, state)
+        else:
+            self.set_state(state)
+            diff_count = state["diff_count"]
         if verbose > 0: print("assembler diff count = %d"%diff_count)
-        update_add(self.weights, weights)
-        update_add(self.biases, biases)
 
-    def load(self, program_name, activity):
+        self.compile_tick_plan()
+        self._weights_changed()
+        if self.engine == "block": self.pack_weights()
+
+    def allocate_activity(self, batch_size=1):
+        """
+        Preallocate the front and back activity buffers swapped by tick,
+        plus scratch space for in-place updates
+        """
+        buffers = getattr(self, "_activity_back", None)
+        if buffers is None or buffers.batch_size != batch_size:
+            self.activity = ActivityBuffer(self.layers, batch_size, self.dtype)
+            self._activity_back = ActivityBuffer(self.layers, batch_size, self.dtype)
+            self._scratch = ActivityBuffer(self.layers, batch_size, self.dtype)
+
+    def initial_activity(self, program_name, activity):
+        """Return the initial pattern for each layer when loading a program"""
+
         # default all layers to off state
-        self.activity = {
-            name: layer.activator.off * np.ones((layer.size,1))
+        initial = {name: layer.activator.off
             for name, layer in self.layers.items()}
 
         # initialize gates
-        self.activity['go'] = self.layers['go'].coder.encode('start')
-        self.activity['gh'] = self.layers['gh'].coder.encode('start')
+        initial['go'] = self.layers['go'].coder.encode('start')
+        initial['gh'] = self.layers['gh'].coder.encode('start')
 
         # initialize pointers
-        self.activity['ip'] = self.layers['ip'].coder.encode(program_name)
+        initial['ip'] = self.layers['ip'].coder.encode(program_name)
         for ms in 'ms':
-            self.activity[ms+'f'] = self.layers[ms+'f'].coder.encode('0')
-            self.activity[ms+'b'] = self.layers[ms+'b'].coder.encode('0')
-        self.activity['mp'] = self.layers['mp'].coder.encode('0')
+            initial[ms+'f'] = self.layers[ms+'f'].coder.encode('0')
+            initial[ms+'b'] = self.layers[ms+'b'].coder.encode('0')
+        initial['mp'] = self.layers['mp'].coder.encode('0')
 
         # initialize comparison
-        self.activity["co"] = self.layers["co"].coder.encode('false')
+        initial["co"] = self.layers["co"].coder.encode('false')
 
         # user initializations
         for layer, token in activity.items():
-            self.activity[layer] = self.layers[layer].coder.encode(token)
+            initial[layer] = self.layers[layer].coder.encode(token)
+
+        return initial
+
+    def load(self, program_name, activity):
+        # single instance
+        self.batch_size = None
+        self.batch_weights, self.batch_biases = {}, {}
+
+        self.allocate_activity(1)
+        self.activity.update(self.initial_activity(program_name, activity))
+
+    def load_batch(self, program_names, activities):
+        """
+        Load a batch of program instances that are executed in lockstep.
+        program_names: one program name per instance, or one name shared by all
+        activities: one dict of user initializations per instance
+        Each layer's activity becomes an (N, B) array, one column per instance.
+        Plastic pathways get per-instance copies of their weights and biases.
+        """
+        B = len(activities)
+        if isinstance(program_names, str): program_names = [program_names]*B
+        self.flush_plasticity()
+
+        self.allocate_activity(B)
+        for b, (program_name, activity) in enumerate(zip(program_names, activities)):
+            initial = self.initial_activity(program_name, activity)
+            for name, pattern in initial.items():
+                self.activity[name][:, b:b+1] = pattern
+
+        self.batch_size = B
+        self.batch_weights, self.batch_biases = {}, {}
+        for key in self.plastic_pathways:
+            # low rank weights are densified per instance
+            self.batch_weights[key] = np.tile(np.asarray(self.weights[key]), (B, 1, 1))
+            self.batch_biases[key] = np.tile(self.biases[key], (B, 1, 1))
+
+    def get_state_decoder(self, layer_names):
+        """Return a (cached) StateDecoder for the given layers"""
+        key = tuple(layer_names)
+        if key not in self.state_decoders:
+            self.state_decoders[key] = StateDecoder(
+                self.layers, layer_names, self.activity.offsets)
+        return self.state_decoders[key]
+
+    def decode_record(self, layer_names=None, tolerance=None):
+        """
+        Decode several layers at once into a StateRecord of token ids,
+        with one row per instance (see StateDecoder.decode)
+        """
+        if layer_names is None: layer_names = self.layers.keys()
+        return self.get_state_decoder(layer_names).decode(
+            self.activity.data, tolerance)
+
+    def decode_columns(self, layer_name):
+        """Decode each column (batched instance) of a layer's activity"""
+        coder = self.layers[layer_name].coder
+        pattern = self.activity[layer_name]
+        return [coder.decode(pattern[:,[b]]) for b in range(pattern.shape[1])]
 
     def initialize_memory(self, pointers, values):
         # pointers = {memory location: {register name: token}} -
         #    token in register is a reference to memory location
         # values = {memory location: {register name: token}} -
         #    token in register is stored at memory location
+        self.flush_plasticity()
+        self.cache_key = None # no longer a cached state
         
         for loc in pointers:
             for reg, tok in pointers[loc].items():
@@ -234,70 +557,337 @@ class NVMNet:
                 self.weights[(reg,'mf')] += dw
                 self.biases[(reg,'mf')] += db
 
-    def tick(self):
+        self._weights_changed()
+        if self.engine == "block": self.pack_weights()
+
+    def tick(self, active=None):
+        """
+        Update activity and plasticity by one time-step.
+        active: optional boolean array with one entry per batched instance.
+            Inactive instances keep their activity and weights unchanged.
+        """
 
         ### NVM tick
         current_gates = self.activity['go']
+        plan = self.get_tick_plan()
 
         # non-binary gate output scaling
         ohr = 1. / (1. - self.pad)
 
-        # activity
-        activity_new = {name: np.zeros(pattern.shape)
-            for name, pattern in self.activity.items()}
-        for (to_layer, from_layer) in self.weights:
-            u = self.gate_map.get_gate_value(
-                (to_layer, from_layer, 'u'), current_gates)
-
-            if u > .5:
-                w = self.weights[(to_layer, from_layer)]
-                b = self.biases[(to_layer, from_layer)]
-                wvb = u * ohr * (w.dot(self.activity[from_layer]) + b)
-                activity_new[to_layer] += wvb
-
-        for name, layer in self.layers.items():
-            d = self.gate_map.get_gate_value((name, name, 'd'), current_gates)
-            s = (1 - self.pad) - d
-
-            if s > .5:
-                wvb = self.w_gain[name] * self.activity[name] + self.b_gain[name]
-                activity_new[name] += s * ohr * wvb
-    
-        for name in activity_new:
-            activity_new[name] = self.layers[name].activator.f(activity_new[name])
-
-        # plasticity
-        for (to_layer, from_layer) in self.weights:
-            l = self.gate_map.get_gate_value(
-                (to_layer, from_layer, 'l'), current_gates)
-            pair_key = (to_layer, from_layer)
-
-            # actg = self.layers["go"].activator
-            # if np.fabs(l - actg.on) < np.fabs(l - actg.off):
-            # if True:
-            if l > .5:
-
-                dw, db = self.learning_rules[pair_key](
-                    self.weights[pair_key],
-                    self.biases[pair_key],
-                    self.activity[from_layer],
-                    self.activity[to_layer],
-                    self.layers[from_layer].activator,
-                    self.layers[to_layer].activator)
-
-                self.weights[pair_key] += ohr * l *dw
-                self.biases[pair_key] += ohr * l *db
-
-        self.activity = activity_new
+        # activity, accumulated in place in the back buffer
+        activity_new = self._activity_back
+        activity_new.data[:] = 0
+
+        # group open pathways and decays by target layer
+        open_updates = plan.open_updates(current_gates)
+        self.flush_plasticity([k for k, _ in open_updates if k in self.deferred])
+        if self.engine == "block":
+            self.get_block_engine([k for k, _ in open_updates])
+        gated = {}
+        for (to_layer, from_layer), u in open_updates:
+            gated.setdefault(to_layer, []).append((from_layer, u))
+        decays = dict(plan.decays(current_gates, self.pad))
+
+        # optional instrumentation
+        tick_layer, tick_pathway = self._tick_layer, self._tick_pathway
+        if self.profiler is not None:
+            tick_layer = self.profiler.timed(self.profiler.layer_times, tick_layer)
+            tick_pathway = self.profiler.timed(self.profiler.learning_times, tick_pathway)
+
+        # each target layer only depends on the previous activity
+        self._run_jobs(tick_layer, [
+            (name, gated.get(name, []), decays.get(name), ohr)
+            for name in self.layers],
+            [k for k, _ in open_updates])
+
+        # freeze inactive instances
+        if active is not None:
+            for name in activity_new:
+                activity_new[name][:, ~active] = self.activity[name][:, ~active]
+
+        # plasticity, each pathway only changes its own weights
+        open_learning = []
+        for pair_key, l in plan.open_learning(current_gates):
+            if active is not None:
+                l = l * active
+                if not l.any(): continue
+            open_learning.append((pair_key, l, ohr))
+        self._run_jobs(tick_pathway, open_learning,
+            [k for k, _, _ in open_learning])
+
+        if self.profiler is not None:
+            self.profiler.count_tick([k for k, _ in open_updates],
+                decays.keys(), [k for k, _, _ in open_learning])
+
+        # swap buffers
+        self.activity, self._activity_back = activity_new, self.activity
+
+        if self.monitor is not None: self.monitor.observe(self.activity)
+
+    def _tick_layer(self, to_layer, gated, s, ohr):
+        # new activity of one target layer
+        # gated: list of (from_layer, u) for open pathways, s: decay gain or None
+        new, scratch = self._activity_back[to_layer], self._scratch[to_layer]
+        profiler = self.profiler # times each forward product if profiling
+
+        # plastic pathways have per-instance weights in batched mode
+        shared = []
+        for from_layer, u in gated:
+            if (to_layer, from_layer) not in self.batch_weights:
+                shared.append((from_layer, u))
+                continue
+            if profiler is not None: start = time.time()
+            w = self.batch_weights[(to_layer, from_layer)]
+            b = self.batch_biases[(to_layer, from_layer)]
+            x = self.activity[from_layer].T[:,:,np.newaxis]
+            new += u * ohr * (np.matmul(w, x) + b)[:,:,0].T
+            if profiler is not None:
+                profiler.add_time(profiler.forward_times, (to_layer, from_layer), start)
+
+        # the block engine only packs dense pathways
+        unpacked = shared
+        if self.engine == "block":
+            offsets = self.block_engine.offsets
+            packed = [(from_layer, u * ohr) for from_layer, u in shared
+                if (to_layer, from_layer) in offsets]
+            unpacked = [(from_layer, u) for from_layer, u in shared
+                if (to_layer, from_layer) not in offsets]
+            if len(packed) > 0:
+                if profiler is not None: start = time.time()
+                new += self.block_engine.forward(
+                    to_layer, packed, self.activity, out=scratch)
+                if profiler is not None:
+                    profiler.add_time(profiler.forward_times,
+                        (to_layer, "+".join(from_layer for from_layer, _ in packed)), start)
+
+        for from_layer, u in unpacked:
+            if profiler is not None: start = time.time()
+            w = self._compute_weights((to_layer, from_layer), self.weights[(to_layer, from_layer)])
+            b = self.biases[(to_layer, from_layer)]
+            # dot only writes into out of the exact result type
+            out = scratch if w.dtype == self.dtype else None
+            wvb = w.dot(self.activity[from_layer], out=out)
+            wvb += b
+            wvb *= u * ohr
+            new += wvb
+            if profiler is not None:
+                profiler.add_time(profiler.forward_times, (to_layer, from_layer), start)
+
+        if s is not None:
+            wvb = np.multiply(self.w_gain[to_layer], self.activity[to_layer],
+                out=scratch)
+            wvb += self.b_gain[to_layer]
+            wvb *= s * ohr
+            new += wvb
+
+        self.layers[to_layer].activator.f(new, out=new)
+
+    def _tick_pathway(self, pair_key, l, ohr):
+        # plasticity of one pathway with an open learning gate
+        if self.batch_size is not None:
+            self._learn_batch(pair_key, l, ohr)
+            return
+
+        (to_layer, from_layer) = pair_key
+        self.cache_key = None # no longer a cached state
+        if self.defer_plasticity:
+            queue = self.deferred.setdefault(pair_key, [])
+            queue.append((self.activity[from_layer].copy(),
+                self.activity[to_layer].copy(), (ohr * l).item()))
+            if len(queue) >= self.max_deferred: self.flush_plasticity([pair_key])
+            return
+
+        dw, db = self.learning_rules[pair_key](
+            self.weights[pair_key],
+            self.biases[pair_key],
+            self.activity[from_layer],
+            self.activity[to_layer],
+            self.layers[from_layer].activator,
+            self.layers[to_layer].activator)
+
+        self.weights[pair_key] += ohr * l *dw
+        self.biases[pair_key] += ohr * l *db
+        self._weights_changed([pair_key])
+
+    def _weights_changed(self, pathways=None):
+        # weights were updated in place: refresh their compute copies
+        if pathways is None: self.compute_weights.clear()
+        else:
+            for pair_key in pathways: self.compute_weights.pop(pair_key, None)
+        if self.block_engine is not None: self.block_engine.weights_changed(pathways)
+
+    def _compute_weights(self, pair_key, w):
+        # lower precision weights (e.g. float16 storage with float32 activity)
+        # are multiplied as a persistent copy in the compute dtype, instead of
+        # numpy converting the whole matrix on every product
+        if not isinstance(w, np.ndarray) or w.dtype.itemsize >= np.dtype(self.dtype).itemsize:
+            return w
+        source, copy = self.compute_weights.get(pair_key, (None, None))
+        if source is not w: # new or replaced
+            copy = w.astype(self.dtype)
+            self.compute_weights[pair_key] = (w, copy)
+        return copy
+
+    def get_thread_pool(self):
+        """Return the persistent thread pool, starting it on first use"""
+        if self.thread_pool is None:
+            self.thread_pool = ThreadPool(self.num_threads)
+        return self.thread_pool
+
+    def close(self):
+        """Stop the thread pool, if started (a later tick starts a new one)"""
+        if self.thread_pool is not None:
+            self.thread_pool.terminate()
+            self.thread_pool.join()
+            self.thread_pool = None
+
+    def _run_jobs(self, function, jobs, pathways):
+        # independent jobs go to the thread pool when there is enough work
+        # (numpy releases the GIL in BLAS and ufuncs), otherwise run serially
+        # pathways: the weights the jobs touch, only sized when threaded
+        if self.num_threads > 1 and len(jobs) > 1 and sum(
+            self.weights[k].size for k in pathways) >= self.parallel_threshold:
+            self.get_thread_pool().map(lambda job: function(*job), jobs)
+        else:
+            for job in jobs: function(*job)
+
+    def _learn_batch(self, pair_key, l, ohr):
+        # per-instance plasticity in batched mode
+        if pair_key not in self.batch_weights:
+            raise Exception(
+                "Plasticity is not supported in batched mode for "+str(pair_key))
+
+        (to_layer, from_layer) = pair_key
+        x, y = self.activity[from_layer], self.activity[to_layer]
+        for i in np.flatnonzero(l):
+            w, b = self.batch_weights[pair_key][i], self.batch_biases[pair_key][i]
+            dw, db = self.learning_rules[pair_key](
+                w, b, x[:,[i]], y[:,[i]],
+                self.layers[from_layer].activator,
+                self.layers[to_layer].activator)
+            w += ohr * l[i] * dw
+            b += ohr * l[i] * db
+
+    def get_probes(self, states):
+        """
+        Precomputed checks of whether the network is in some control states.
+        states: list of (layer name, token), e.g. [("gh", "start"), ("opc", "exit")]
+        Returns (tables, rows, thresholds, codes, counts):
+            tables: per layer involved, (layer name, threshold, coder,
+                {decode table key: index of the first state with that token})
+            rows: rows of the layers involved in the activity buffer
+            thresholds: the threshold of each row
+            codes: (K, R) array, +1 (-1) where state k's token is on (off)
+                in its layer's rows and 0 elsewhere
+            counts: (K, 1) number of units on in each state's token
+        State k holds exactly when codes[k] dotted with the thresholded (0/1)
+        rows equals counts[k]. Tokens that a layer can not decode to (not
+        encoded, or aliased by another token) never hold.
+        Cached until more tokens are encoded in the layers involved.
+        """
+        key = tuple(states)
+        coders = [self.layers[layer_name].coder for layer_name, _ in states]
+        sizes = tuple(len(coder.encodings) for coder in coders)
+        if key in self.probes and self.probes[key][0] == sizes:
+            return self.probes[key][1]
+
+        names = []
+        for layer_name, _ in states:
+            if layer_name not in names: names.append(layer_name)
+        tables = [(name, self.layers[name].activator.threshold,
+            self.layers[name].coder, {}) for name in names]
+        rows = np.concatenate([np.arange(*self.activity.offsets[name]) for name in names])
+        thresholds = np.concatenate([np.full(self.layers[name].size, threshold)
+            for (name, threshold, _, _) in tables])[:,np.newaxis]
+        starts = dict(zip(names, np.cumsum([0] + [self.layers[name].size for name in names])))
+
+        codes = np.zeros((len(states), len(rows)), dtype=self.dtype)
+        counts = np.full((len(states), 1), -1.)
+        for k, ((layer_name, token), coder) in enumerate(zip(states, coders)):
+            if token not in coder.encodings: continue
+            pattern = coder.encodings[token]
+            if coder.decodings.get(coder.hash_pattern(pattern)) != token: continue
+            on = pattern.reshape(-1) > self.layers[layer_name].activator.threshold
+            start = starts[layer_name]
+            codes[k, start:start + on.size] = np.where(on, 1., -1.)
+            counts[k] = on.sum()
+            tables[names.index(layer_name)][3].setdefault(coder.hash_bits(on), k)
+
+        probes = (tables, rows, thresholds, codes, counts)
+        self.probes[key] = (sizes, probes)
+        return probes
+
+    def control_state(self, states):
+        """
+        Index of the first of several control states that holds, or -1 if none.
+        states: list of (layer name, token), as in get_probes
+        A single instance is checked by thresholding each layer involved once
+        and looking it up among the states' keys only. A batch is checked all
+        at once by one product with probe vectors, instead of decoding each
+        layer of each instance.
+        Returns an int, or an int array with one entry per batched instance.
+        """
+        return self._control_state(self.get_probes(states))
+
+    def _control_state(self, probes):
+        tables, rows, thresholds, codes, counts = probes
+        if self.batch_size is None:
+            first = -1
+            for name, threshold, coder, table in tables:
+                k = table.get(coder.hash_bits(self.activity[name] > threshold), -1)
+                if k >= 0 and (first < 0 or k < first): first = k
+            return first
+
+        on = self.activity.data.take(rows, axis=0) > thresholds
+        held = codes.dot(on) == counts
+        return np.where(held.any(axis=0), held.argmax(axis=0), -1)
+
+    def run_until(self, states, max_ticks, active=None, callback=None):
+        """
+        Tick until the network is in any of several control states.
+        states: list of (layer name, token), as in control_state
+        active: optional boolean array of batched instances to run; each
+            instance is frozen once it reaches one of the states
+        callback: optional function called after every tick
+        Returns the number of ticks taken and the index of the state reached
+        (None if max_ticks ran out first), or for batches an array of indices
+        with -1 for instances that did not reach any state.
+        """
+        # tokens are not encoded while ticking, so the probes stay valid
+        probes = self.get_probes(states)
+        if self.batch_size is None:
+            for t in range(max_ticks):
+                self.tick()
+                if callback is not None: callback()
+                reached = self._control_state(probes)
+                if reached >= 0: return t+1, reached
+            return max_ticks, None
+
+        if active is None: active = np.ones(self.batch_size, dtype=bool)
+        active = active.copy()
+        reached = np.full(self.batch_size, -1)
+        for t in range(max_ticks):
+            if not active.any(): return t, reached
+            self.tick(active=active)
+            if callback is not None: callback()
+            state = self._control_state(probes)
+            done = active & (state >= 0)
+            reached[done] = state[done]
+            active &= ~done
+        return max_ticks, reached
+
+    def _decodes_to(self, layer_name, token):
+        # boolean, or boolean array with one entry per batched instance
+        return self.control_state([(layer_name, token)]) == 0
 
     def at_start(self):
-        return self.layers["gh"].coder.decode(self.activity["gh"]) == "start"
+        return self._decodes_to("gh", "start")
 
     def at_ready(self):
-        return self.layers["gh"].coder.decode(self.activity["gh"]) == "ready"
+        return self._decodes_to("gh", "ready")
 
     def at_exit(self):
-        return (self.layers["opc"].coder.decode(self.activity["opc"]) == "exit")
+        return self._decodes_to("opc", "exit")
 
     def state_string(self, show_layers=[], show_tokens=False, show_corrosion=False, show_gates=False):
         s = ""
@@ -109,11 +109,12 @@ def _expand_hadamard(N):
 
     return H
 
-def random_hadamard(N, P):
+def random_hadamard(N, P, random_state=np.random):
     """
     Create randomized hadamard matrix of size NxP.
     N must be a valid Hadamard size.
     If P > N, only N columns are returned.
+    Randomness is drawn from random_state (default the global np.random).
     """
     
     # Expand as necessary
@@ -121,11 +122,11 @@ def random_hadamard(N, P):
     H = _expand_hadamard_non_sylvester(N)[:N,:min(N,P)]
 
     # Randomly negate rows
-    R = np.sign(np.random.randn(H.shape[0],1)) * H
+    R = np.sign(random_state.randn(H.shape[0],1)) * H
 
     # Randomly interchange N pairs of rows
     for _ in range(N):
-        m, n = np.random.randint(N), np.random.randint(N)
+        m, n = random_state.randint(N), random_state.randint(N)
         R[n,:], R[m,:] = R[m,:].copy(), R[n,:].copy()
     
     # # Interchange every pair of rows with some probability (N^2 time)
@@ -135,17 +136,17 @@ def random_hadamard(N, P):
 
     return R
 
-def random_orthogonal_patterns(N, P):
+def random_orthogonal_patterns(N, P, random_state=np.random):
     """
     Create an NxP matrix of roughly orthogonal patterns.
     N must be a valid Hadamard size.
     If P > N, then orthogonality is only preserved within successive groups of N columns.
     """
-    R = random_hadamard(N, P)
+    R = random_hadamard(N, P, random_state)
 
     while R.shape[1] < P:
         R = np.concatenate(
-            (R, random_hadamard(N, P - R.shape[1])), axis=1)
+            (R, random_hadamard(N, P - R.shape[1], random_state)), axis=1)
 
     return R
 
@@ -1,6 +1,6 @@
 import numpy as np
 from layer import Layer
-from coder import Coder
+from coder import Coder, seeded_random_state
 
 class Sequencer(object):
 
@@ -8,12 +8,15 @@ class Sequencer(object):
         self.sequence_layer = sequence_layer
         self.input_layers = input_layers
         self.transits = []
+        # anonymous states are reproducible if the layer's coder is seeded
+        seed = sequence_layer.coder.seed
+        self.random_state = np.random if seed is None else seeded_random_state(seed, "sequencer")
 
     def add_transit(self, new_state=None, **input_states):
 
         # Generate states if not provided, encode as necessary
         if new_state is None:
-            new_state = self.sequence_layer.activator.make_pattern()
+            new_state = self.sequence_layer.activator.make_pattern(random_state=self.random_state)
         if type(new_state) is str:
             new_state = self.sequence_layer.coder.encode(new_state)
 
@@ -64,7 +67,7 @@ class Sequencer(object):
         W, Z, residual = zsolve(X, Y,
             self.sequence_layer.activator.f,
             self.sequence_layer.activator.g,
-            verbose=verbose)
+            verbose=verbose, random_state=self.random_state)
         
         # Split up weights and biases
         weights = {}
@@ -80,11 +83,12 @@ class Sequencer(object):
         # return final weights, bias, matrices, residual
         return weights, biases, (X, Y, Z), residual
 
-def zsolve(X, Y, f, g, verbose=False):
+def zsolve(X, Y, f, g, verbose=False, random_state=np.random):
     """
     Construct W that transitions states in X to corresponding states in Y
     X, Y are arrays, with paired activity patterns as columns
     f, g are the activation function and its inverse    
+    random_state draws the hidden step (default the global np.random)
     To deal with low-rank X, each transition uses an intermediate "hidden step"
     """
 
@@ -98,7 +102,7 @@ def zsolve(X, Y, f, g, verbose=False):
     
     # use A to set intermediate Z that is low-rank pre non-linearity
     Z = np.zeros(X.shape)
-    Z[:N,:] = f(np.random.randn(N, A.shape[0]).dot(A))
+    Z[:N,:] = f(random_state.randn(N, A.shape[0]).dot(A))
     Z[N,:] = 1. # bias
 
     # solve linear equations
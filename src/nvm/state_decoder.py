@@ -0,0 +1,104 @@
+import numpy as np
+
+class StateRecord:
+    """
+    Compact decoded state of several layers, one row per batched instance.
+    ids[b, l] is the index of layer l's token in its coder's codes (-1 if
+    the pattern decodes to no token), and clean[b, l] is whether it decoded
+    and every unit was within tolerance of on or off.
+    """
+
+    def __init__(self, decoder, ids, clean):
+        self.decoder = decoder
+        self.layer_names = decoder.layer_names
+        self.ids = ids
+        self.clean = clean
+
+    def tokens(self, b=0):
+        """Dict of layer name -> decoded token string for one instance"""
+        return {name: self.decoder.token(l, self.ids[b, l])
+            for l, name in enumerate(self.layer_names)}
+
+    def as_states(self):
+        """List of token dicts, one per instance"""
+        return [self.tokens(b) for b in range(self.ids.shape[0])]
+
+class StateDecoder:
+    """
+    Decodes several layers in one pass over a contiguous ActivityBuffer.
+    The rows of all requested layers are thresholded together and each
+    layer's bits are then looked up in the decode table of its coder.
+    """
+
+    def __init__(self, layers, layer_names, offsets):
+        """
+        layers: dict of all layers
+        layer_names: the layers to decode, in record order
+        offsets: layer name -> (start, end) rows in the buffer, as in ActivityBuffer
+        """
+        self.layer_names = list(layer_names)
+        self.coders = [layers[name].coder for name in self.layer_names]
+
+        # each layer's rows are padded to whole bytes, so that the thresholded
+        # bits of all layers can be packed together and sliced per layer
+        # padding rows are never on and have undefined (nan) corrosion
+        rows, thresholds, mid, half = [], [], [], []
+        self.bounds = [] # layer -> (start, end) rows in the padded layout
+        for name in self.layer_names:
+            start, end = offsets[name]
+            padding = -(end - start) % 8
+            activator = layers[name].activator
+            self.bounds.append((len(rows), len(rows) + end - start))
+            rows.extend(list(range(start, end)) + [start]*padding)
+            thresholds.extend([activator.threshold]*(end - start) + [np.inf]*padding)
+            mid.extend([(activator.on + activator.off)/2.]*(end - start) + [np.nan]*padding)
+            half.extend([abs(activator.on - activator.off)/2.]*(end - start + padding))
+        self.rows = np.array(rows, dtype=int)
+        self.thresholds = np.array(thresholds)[:,np.newaxis]
+        self.mid = np.array(mid)[:,np.newaxis]
+        self.half = np.array(half)[:,np.newaxis]
+        self.starts = np.array([start for (start, end) in self.bounds], dtype=int)
+
+        # per layer lookup: (decode table, whether packed, bit bounds)
+        self.tables = [(coder.code_index, coder.packed, start, end)
+            for coder, (start, end) in zip(self.coders, self.bounds)]
+        self.any_packed = any(coder.packed for coder in self.coders)
+
+    def decode(self, data, tolerance=None):
+        """
+        Decode the requested layers from a buffer's data array
+        tolerance: maximum corrosion for a layer to be clean (None skips the check)
+        Returns a StateRecord
+        """
+        x = data.take(self.rows, axis=0)
+        bits = (x > self.thresholds).T
+        B, R = bits.shape
+
+        # decode table keys are byte slices of all the bits at once
+        unpacked = bits.tobytes()
+        packed = np.packbits(bits, axis=1).tobytes() if self.any_packed else None
+
+        ids = []
+        for b in range(B):
+            for code_index, is_packed, start, end in self.tables:
+                if is_packed:
+                    key = packed[(b*R + start)//8:(b*R + end + 7)//8]
+                else:
+                    key = unpacked[b*R + start:b*R + end]
+                ids.append(code_index.get(key, -1))
+        ids = np.array(ids, dtype=int).reshape(B, len(self.tables))
+
+        clean = ids >= 0
+        if tolerance is not None:
+            # distance to the nearer of on and off, as in Activator.corrosion
+            corrosion = np.fabs(np.fabs(x - self.mid) - self.half)
+            corrosion = np.fmax.reduceat(corrosion, self.starts, axis=0)
+            clean &= (corrosion <= tolerance).T
+
+        return StateRecord(self, ids, clean)
+
+    def token(self, l, i):
+        """Token string of code index i in layer l, "?" if i < 0"""
+        if i < 0: return "?"
+        coder = self.coders[l]
+        return coder.decodings[coder.code_keys[i]]
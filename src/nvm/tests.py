@@ -1,7 +1,22 @@
+import numpy as np
 import itertools as it
 import unittest as ut
+import warnings
+import os
+import shutil
+import tempfile
+import threading
 from refvm import RefVM
 from nvm import make_scaled_nvm
+from activator import tanh_activator, logistic_activator
+from learning_rules import rehebbian, sequential_updates, linear_solve, learn, learn_jointly, row_separable
+from incremental_solver import IncrementalSolver
+from low_rank import LowRankMatrix
+from coder import Coder
+from layer import Layer
+from health_monitor import HealthWarning
+from nvm_cache import NetworkCache
+from nvm_assembler import assemble
 
 class VMTestCase(ut.TestCase):
 
@@ -36,6 +51,11 @@ class VMTestCase(ut.TestCase):
                 vm.step(verbose=verbose)
             
             self.assertTrue(t == len(trace))
+            self._check_run(vm)
+
+    def _check_run(self, vm):
+        """Extra checks after each program run, for subclasses"""
+        pass
 
     # @ut.skip("")
     def test_noop(self):
@@ -537,6 +557,726 @@ class NVMOrthogonalTestCase(VMTestCase):
             extra_tokens=extra_tokens,
             verbose=verbose)
 
+class NVMBlockEngineTestCase(VMTestCase):
+    def _make_vm(self, num_registers, programs, extra_tokens, verbose=False):
+        return make_scaled_nvm(
+            register_names = ["r%d"%r for r in range(num_registers)],
+            programs = programs,
+            orthogonal=True,
+            extra_tokens=extra_tokens,
+            verbose=verbose,
+            engine="block")
+
+class NVMFloat32TestCase(VMTestCase):
+    def _make_vm(self, num_registers, programs, extra_tokens, verbose=False):
+        return make_scaled_nvm(
+            register_names = ["r%d"%r for r in range(num_registers)],
+            programs = programs,
+            orthogonal=True,
+            extra_tokens=extra_tokens,
+            verbose=verbose,
+            dtype=np.float32,
+            weight_dtype=np.float16)
+
+    def test_compute_weights(self):
+
+        # float16 weights are multiplied as float32 copies, kept in sync with
+        # plasticity (mem) and reused while the weights do not change
+        program = """
+        start:  mov r0 A
+                mem r0
+                nxt
+                mov r0 B
+                mem r0
+                exit
+        """
+        programs = {"test": program}
+        for engine in ["dict", "block"]:
+            nvm = make_scaled_nvm(["r0"], programs, extra_tokens=["A","B"],
+                dtype=np.float32, weight_dtype=np.float16, engine=engine)
+            nvm.assemble(programs, other_tokens=["A","B"])
+            nvm.load("test", {"r0": "B"})
+            net, copies = nvm.net, {}
+            def check():
+                for key, (source, copy) in net.compute_weights.items():
+                    self.assertTrue(copy.dtype == np.float32)
+                    self.assertTrue(np.array_equal(copy, net.weights[key]))
+                    self.assertTrue(copies.setdefault(key, copy) is copy or key in net.plastic_pathways)
+                if engine == "block":
+                    blocks = net.block_engine.blocks
+                    for to_layer, copy in net.block_engine.compute.items():
+                        if to_layer not in net.block_engine.changed:
+                            self.assertTrue(np.array_equal(copy, blocks[to_layer]))
+            ticks, index = net.run_until([("opc", "exit")], 500, callback=check)
+            self.assertTrue(index == 0)
+            self.assertTrue(len(copies) > 0 or engine == "block")
+
+class NVMFloat16BlockTestCase(VMTestCase):
+    def _make_vm(self, num_registers, programs, extra_tokens, verbose=False):
+        return make_scaled_nvm(
+            register_names = ["r%d"%r for r in range(num_registers)],
+            programs = programs,
+            orthogonal=True,
+            extra_tokens=extra_tokens,
+            verbose=verbose,
+            engine="block",
+            dtype=np.float32,
+            weight_dtype=np.float16)
+
+class NVMThreadedTestCase(VMTestCase):
+    def _make_vm(self, num_registers, programs, extra_tokens, verbose=False):
+        vm = make_scaled_nvm(
+            register_names = ["r%d"%r for r in range(num_registers)],
+            programs = programs,
+            orthogonal=True,
+            extra_tokens=extra_tokens,
+            verbose=verbose,
+            num_threads=4,
+            parallel_threshold=0)
+        self.addCleanup(vm.close) # stop its pool threads
+        return vm
+
+    def test_close(self):
+
+        programs = {"test": """
+        start:  mov r0 A
+                exit
+        """}
+        threads = threading.active_count()
+        with self._make_vm(1, programs, ["A"]) as vm:
+            vm.assemble(programs, other_tokens=["A"])
+            vm.load("test", {"r0": None})
+            while not vm.at_exit(): vm.step()
+            self.assertTrue(threading.active_count() > threads)
+        self.assertTrue(threading.active_count() == threads)
+
+class NVMLowRankTestCase(VMTestCase):
+    def _make_vm(self, num_registers, programs, extra_tokens, verbose=False):
+        return make_scaled_nvm(
+            register_names = ["r%d"%r for r in range(num_registers)],
+            programs = programs,
+            orthogonal=True,
+            extra_tokens=extra_tokens,
+            verbose=verbose,
+            low_rank=True)
+
+    def test_low_rank_weights(self):
+
+        program = """
+        start:  mov r0 A
+                mem r0
+                nxt
+                rem r0
+                exit
+        """
+        vm = self._make_vm(1, {"test": program}, extra_tokens=["A"])
+        vm.assemble({"test": program})
+        vm.load("test", {"r0": None})
+        while not vm.at_exit(): vm.step()
+
+        # plastic weights are kept as factors, and mem wrote r0 <- mf
+        for pair_key in vm.net.plastic_pathways:
+            if pair_key == ("co","ci"): continue
+            self.assertTrue(isinstance(vm.net.weights[pair_key], LowRankMatrix))
+        self.assertTrue(vm.net.weights[("r0","mf")].rank > 0)
+
+class NVMDeferredPlasticityTestCase(VMTestCase):
+    def _make_vm(self, num_registers, programs, extra_tokens, verbose=False):
+        return make_scaled_nvm(
+            register_names = ["r%d"%r for r in range(num_registers)],
+            programs = programs,
+            orthogonal=True,
+            extra_tokens=extra_tokens,
+            verbose=verbose,
+            defer_plasticity=True)
+
+    def test_deferred(self):
+
+        program = """
+        start:  mov r0 A
+                mem r0
+                nxt
+                mov r0 B
+                exit
+        """
+        vm = self._make_vm(1, {"test": program}, extra_tokens=["A","B"])
+        vm.assemble({"test": program})
+        vm.load("test", {"r0": None})
+        queued = False
+        while not vm.at_exit():
+            vm.step()
+            queued = queued or len(vm.net.deferred) > 0
+
+        # plasticity was queued mid-run, and flushing applies all of it
+        self.assertTrue(queued)
+        vm.net.flush_plasticity()
+        self.assertTrue(len(vm.net.deferred) == 0)
+
+class NVMFastPathTestCase(VMTestCase):
+    def _make_vm(self, num_registers, programs, extra_tokens, verbose=False):
+        return make_scaled_nvm(
+            register_names = ["r%d"%r for r in range(num_registers)],
+            programs = programs,
+            orthogonal=True,
+            extra_tokens=extra_tokens,
+            verbose=verbose,
+            fast_path=True)
+
+    def _check_run(self, vm):
+        self.assertTrue(vm.instruction_counts["fast"] > 0)
+
+    def test_matches_neural(self):
+
+        program = """
+        start:  mov r0 A
+                mov r1 r0
+                cmp r0 r1
+                jie same
+                mov r1 B
+        same:   mov r0 B
+                cmp r0 r1
+                jie start
+                exit
+        """
+        vm = self._make_vm(2, {"test": program}, extra_tokens=["A","B","same"])
+        vm.assemble({"test": program})
+
+        # same register states with and without the fast path
+        states = []
+        for fast_path in [True, False]:
+            vm.fast_path = fast_path
+            vm.load("test", {"r0": None, "r1": None})
+            states.append([])
+            while not vm.at_exit():
+                vm.step()
+                states[-1].append(vm.decode_state(vm.register_names))
+        self.assertTrue(states[0] == states[1])
+        self.assertTrue(vm.instruction_counts["neural"] > 0)
+
+class NVMPackedPatternsTestCase(VMTestCase):
+    def _make_vm(self, num_registers, programs, extra_tokens, verbose=False):
+        return make_scaled_nvm(
+            register_names = ["r%d"%r for r in range(num_registers)],
+            programs = programs,
+            orthogonal=False,
+            extra_tokens=extra_tokens,
+            verbose=verbose,
+            packed_patterns=True)
+
+class NVMBatchTestCase(ut.TestCase):
+
+    def test_lockstep(self):
+
+        program = """
+        start:  cmp r0 r1
+                jie same
+                mem r0
+                nxt
+                mov r0 r1
+                prv
+                rem r0
+                exit
+        same:   mov r1 B
+                exit
+        """
+        register_names = ["r0", "r1"]
+        initial_states = [
+            {"r0": "A", "r1": "A"},
+            {"r0": "A", "r1": "B"},
+            {"r0": "B", "r1": "A"},
+            {"r0": "B", "r1": "B"}]
+        programs = {"test": program}
+        extra_tokens = ["start", "same", "A", "B"]
+
+        nvm = make_scaled_nvm(register_names, programs,
+            orthogonal=True, extra_tokens=extra_tokens)
+        nvm.assemble(programs, other_tokens=extra_tokens)
+        nvm.load_batch("test", initial_states)
+
+        rvms = []
+        for initial_state in initial_states:
+            rvm = RefVM(register_names)
+            rvm.assemble(programs, other_tokens=extra_tokens)
+            rvm.load("test", dict(initial_state))
+            rvms.append(rvm)
+
+        for t in range(20):
+            exits = nvm.at_exit()
+            self.assertTrue(list(exits) == [rvm.at_exit() for rvm in rvms])
+            if exits.all(): break
+            layer_names = register_names + ["co"]
+            states = nvm.decode_state(layer_names)
+            for state, rvm in zip(states, rvms):
+                self.assertTrue(state == rvm.decode_state(layer_names))
+            self.assertTrue(nvm.step().all())
+            for rvm in rvms:
+                if not rvm.at_exit(): rvm.step()
+
+        self.assertTrue(nvm.at_exit().all())
+
+    def test_decode_record(self):
+
+        program = """
+        start:  mov r0 A
+                cmp r0 r1
+                exit
+        """
+        programs = {"test": program}
+        for packed in [False, True]:
+            nvm = make_scaled_nvm(["r0", "r1"], programs,
+                extra_tokens=["A", "B"], packed_patterns=packed)
+            nvm.assemble(programs, other_tokens=["A", "B"])
+            nvm.load_batch("test", [{"r0": "B", "r1": "A"}, {"r0": "B", "r1": "B"}])
+            for t in range(3):
+                layer_names = list(nvm.net.layers.keys())
+                record = nvm.decode_record(layer_names)
+                columns = [nvm.net.decode_columns(name) for name in layer_names]
+                for b in range(2):
+                    self.assertTrue(record.tokens(b) == {
+                        name: column[b] for name, column in zip(layer_names, columns)})
+                    for l, name in enumerate(layer_names):
+                        layer = nvm.net.layers[name]
+                        clean = columns[l][b] != "?" and layer.activator.corrosion(
+                            nvm.net.activity[name][:,b]) <= nvm.fast_corrosion
+                        self.assertTrue(record.clean[b, l] == clean)
+                nvm.step()
+
+    def test_run_until(self):
+
+        program = """
+        start:  mov r0 A
+                exit
+        """
+        programs = {"test": program}
+        nvm = make_scaled_nvm(["r0"], programs, extra_tokens=["A"])
+        nvm.assemble(programs, other_tokens=["A"])
+        nvm.load("test", {"r0": "B"})
+        states = [("gh", "ready"), ("gh", "start"), ("opc", "exit"), ("r0", "C")]
+
+        # probes agree with decoding on every tick
+        def check():
+            decoded = [i for i, (name, token) in enumerate(states)
+                if nvm.decode_layer(name) == token]
+            self.assertTrue(nvm.net.control_state(states) ==
+                (decoded[0] if len(decoded) > 0 else -1))
+        ticks, reached = nvm.net.run_until(states[1:], 50, callback=check)
+        self.assertTrue(reached == 0)
+        self.assertTrue(nvm.decode_layer("r0") == "A")
+        ticks, reached = nvm.net.run_until(states[2:], 50, callback=check)
+        self.assertTrue(reached == 0)
+        self.assertTrue(nvm.at_exit())
+
+    def test_open_gates(self):
+
+        program = """
+        start:  mov r0 A
+                exit
+        """
+        programs = {"test": program}
+        nvm = make_scaled_nvm(["r0"], programs, extra_tokens=["A"])
+        nvm.assemble(programs, other_tokens=["A"])
+        nvm.load("test", {"r0": "B"})
+        gate_map, a = nvm.net.gate_map, nvm.net.layers["go"].activator
+
+        # same as checking every key
+        def check():
+            pattern = nvm.net.activity["go"]
+            expected = [k for k in gate_map.gate_keys
+                if np.fabs(gate_map.get_gate_value(k, pattern) - a.on) <
+                    np.fabs(gate_map.get_gate_value(k, pattern) - a.off)]
+            self.assertTrue(nvm.net.get_open_gates() == expected)
+        nvm.net.run_until([("opc", "exit")], 50, callback=check)
+
+        indices = gate_map.get_gate_indices(to_layer="gh", gate_type="u")
+        self.assertTrue([gate_map.get_gate_key(i) for i in indices] ==
+            [k for k in gate_map.gate_keys if k[0] == "gh" and k[2] == "u"])
+
+class CoderTestCase(ut.TestCase):
+
+    def test_decode_nearest(self):
+
+        act = tanh_activator(.0001, 64)
+        coder = Coder(act)
+        tokens = ["t%d"%t for t in range(40)]
+        for token in tokens: coder.encode(token)
+
+        # exact patterns decode with no distance
+        token, distance, margin = coder.decode_nearest(coder.encode("t3"))
+        self.assertTrue((token, distance) == ("t3", 0))
+        self.assertTrue(margin > 0)
+
+        # near misses are recovered
+        pattern = coder.encode("t3").copy()
+        pattern[[0, 5]] *= -1
+        self.assertTrue(coder.decode(pattern) == "?")
+        token, distance, margin = coder.decode_nearest(pattern)
+        self.assertTrue((token, distance) == ("t3", 2))
+
+        # batches decode column by column
+        patterns = np.concatenate((coder.encode("t1"), pattern), axis=1)
+        tokens, distances, margins = coder.decode_nearest(patterns)
+        self.assertTrue(tokens == ["t1", "t3"])
+        self.assertTrue(distances == [0, 2])
+
+    def test_packed(self):
+
+        act = tanh_activator(.0001, 100)
+        coder = Coder(act, packed=True, cache_size=4)
+        tokens = ["t%d"%t for t in range(40)]
+        patterns = [coder.encode(token).copy() for token in tokens]
+        hidden = np.random.randn(100, 1)
+        coder.encode("h", hidden)
+
+        # patterns are materialized exactly, beyond the cache too
+        for token, pattern in zip(tokens, patterns):
+            self.assertTrue(np.array_equal(coder.encode(token), pattern))
+            self.assertTrue(coder.decode(pattern) == token)
+        self.assertTrue(len(coder.encodings.cache) == 4)
+
+        # non-binary patterns are kept as is
+        self.assertTrue(coder.encode("h") is hidden)
+        self.assertTrue(coder.decode(np.sign(hidden)) == "h")
+
+        pattern = patterns[3].copy()
+        pattern[[0, 5]] *= -1
+        token, distance, margin = coder.decode_nearest(pattern)
+        self.assertTrue((token, distance) == ("t3", 2))
+
+    def test_decode_within(self):
+
+        act = tanh_activator(.0001, 128)
+        coder = Coder(act, index_radius=6)
+        tokens = ["t%d"%t for t in range(200)]
+        for token in tokens: coder.encode(token)
+
+        pattern = coder.encode("t7").copy()
+        self.assertTrue(coder.decode_within(pattern) == ("t7", 0))
+        pattern[:5] *= -1
+        self.assertTrue(coder.decode_within(pattern) == ("t7", 5))
+        self.assertTrue(coder.decode_within(pattern) == coder.decode_nearest(pattern)[:2])
+        pattern[5:10] *= -1
+        self.assertTrue(coder.decode_within(pattern) == ("?", -1))
+
+        # tokens encoded later are indexed too
+        coder.encode("new")
+        pattern = coder.encode("new").copy()
+        pattern[[3]] *= -1
+        self.assertTrue(coder.decode_within(pattern) == ("new", 1))
+
+    def test_encode_many(self):
+
+        act = tanh_activator(.0001, 64)
+        tokens = ["t%d"%t for t in range(40)]
+
+        # same patterns as encoding one token at a time
+        np.random.seed(0)
+        coder = Coder(act)
+        expected = np.concatenate([coder.encode(token) for token in tokens], axis=1)
+        np.random.seed(0)
+        coder = Coder(act)
+        coder.encode("t0")
+        patterns = coder.encode_many(tokens + ["t1"])
+        self.assertTrue(np.array_equal(patterns[:,:-1], expected))
+        for token in tokens: self.assertTrue(coder.decode(coder.encode(token)) == token)
+
+        # consecutive tokens are views of the encoding matrix
+        self.assertTrue(np.shares_memory(coder.encode_many(tokens[5:9]), coder.matrix))
+        self.assertTrue(np.array_equal(coder.encode_many(tokens[::-1]), expected[:,::-1]))
+
+    def test_encode_g(self):
+
+        act = tanh_activator(.0001, 64)
+        tokens = ["t%d"%t for t in range(40)]
+        coder = Coder(act)
+        coder.encode("x", act.make_pattern())
+
+        # same values as applying g, computed once
+        gX = coder.encode_many_g(tokens[:30] + ["x"])
+        self.assertTrue(np.array_equal(gX, act.g(coder.encode_many(tokens[:30] + ["x"]))))
+        self.assertTrue(np.shares_memory(coder.encode_many_g(tokens[5:9]), coder.g_matrix))
+        self.assertTrue(np.array_equal(coder.encode_many_g(tokens[::-1]), act.g(coder.encode_many(tokens[::-1]))))
+        self.assertTrue(coder.encode_g("x") is coder.encode_g("x"))
+
+    def test_seeded(self):
+
+        act = tanh_activator(.0001, 64)
+        tokens = ["t%d"%t for t in range(20)]
+
+        # same patterns regardless of encoding order and global random state
+        np.random.seed(0)
+        coder = Coder(act, seed=5)
+        expected = coder.encode_many(tokens).copy()
+        np.random.seed(1)
+        coder = Coder(act, seed=5)
+        for token in tokens[::-1]: coder.encode(token)
+        self.assertTrue(np.array_equal(coder.encode_many(tokens), expected))
+        self.assertTrue(np.array_equal(coder.seeded_patterns(tokens), expected))
+        self.assertFalse(np.array_equal(Coder(act, seed=6).encode_many(tokens), expected))
+
+        # seeded orthogonal columns only depend on the set of tokens
+        act = tanh_activator(.0001, 16)
+        patterns = Layer("l", (16,1), act, Coder(act, seed=5)).encode_tokens(
+            tokens[:10], orthogonal=True)
+        shuffled = Layer("l", (16,1), act, Coder(act, seed=5)).encode_tokens(
+            tokens[:10][::-1], orthogonal=True)
+        self.assertTrue(np.array_equal(shuffled, patterns[:,::-1]))
+        self.assertTrue(np.allclose(patterns.T.dot(patterns), patterns[:,0].dot(patterns[:,0])*np.eye(10)))
+
+class LearningRuleTestCase(ut.TestCase):
+
+    def test_rehebbian_batches(self):
+
+        np.random.seed(0)
+        N, P = 64, 50
+        for act in [tanh_activator(.0001, N), logistic_activator(.0001, N)]:
+            X, Y = act.make_pattern(P), act.make_pattern(P)
+            w, b = np.random.randn(N,N)*.01, np.random.randn(N,1)*.01
+
+            # one pair at a time
+            w1, b1 = w.copy(), b.copy()
+            for p in range(P):
+                dw, db = rehebbian(w1, b1, X[:,[p]], Y[:,[p]], act, act)
+                w1, b1 = w1 + dw, b1 + db
+
+            for batch_size in [1, 7, 64]:
+                dw, db = rehebbian(w, b, X, Y, act, act, batch_size=batch_size)
+                self.assertTrue(np.allclose(w + dw, w1) and np.allclose(b + db, b1))
+
+            # factored and scaled updates agree with dense and unscaled ones
+            dw, db = rehebbian(LowRankMatrix((N,N)), np.zeros((N,1)), X, Y, act, act, batch_size=16)
+            dw0, db0 = rehebbian(np.zeros((N,N)), np.zeros((N,1)), X, Y, act, act)
+            self.assertTrue(np.allclose(dw.toarray(), dw0) and np.allclose(db, db0))
+            scales = np.random.rand(P)
+            dw, db = sequential_updates(rehebbian, w, b, X, Y, act, act, scales, batch_size=16)
+            w1, b1 = w.copy(), b.copy()
+            for p in range(P):
+                dw1, db1 = rehebbian(w1, b1, X[:,[p]], Y[:,[p]], act, act)
+                w1, b1 = w1 + scales[p]*dw1, b1 + scales[p]*db1
+            self.assertTrue(np.allclose(w + dw, w1) and np.allclose(b + db, b1))
+
+    def test_learn_jointly(self):
+
+        np.random.seed(0)
+        P = 20
+        actx = tanh_activator(.0001, 32)
+        actys = [tanh_activator(.0001, 16), logistic_activator(.0001, 24)]
+        X = actx.make_pattern(P)
+        Ys = [acty.make_pattern(P) for acty in actys]
+        for rule in row_separable:
+            ws = [np.zeros((Y.shape[0], X.shape[0])) for Y in Ys]
+            bs = [np.zeros((Y.shape[0], 1)) for Y in Ys]
+            results = learn_jointly(ws, bs, X, Ys, actx, actys, rule)
+            for i, acty in enumerate(actys):
+                w, b, dc = learn(ws[i], bs[i], X, Ys[i], actx, acty, rule)
+                self.assertTrue(np.allclose(results[0][i], w) and np.allclose(results[1][i], b))
+                self.assertEqual(results[2][i], dc)
+
+    def test_parallel_assembly(self):
+
+        programs = {
+            "one": """
+            start:  mov r0 A
+                    jmp start
+            """,
+            "two": """
+                    mov r1 B
+                    cmp r1 r0
+                    exit
+            """}
+        nets = []
+        for num_processes in [1, 2]:
+            nvm = make_scaled_nvm(["r0","r1"], programs, extra_tokens=["A","B"], seed=0)
+            nvm.assemble(programs, num_processes=num_processes)
+            nets.append(nvm.net)
+
+        # same weights as a serial assembly
+        self.assertTrue(sorted(nets[0].weights.keys()) == sorted(nets[1].weights.keys()))
+        for k in nets[0].weights:
+            self.assertTrue(np.array_equal(nets[0].weights[k], nets[1].weights[k]))
+            self.assertTrue(np.array_equal(nets[0].biases[k], nets[1].biases[k]))
+
+    def test_orthogonal_reassembly(self):
+
+        programs = {"test": """
+            start:  mov r0 A
+                    mov r0 B
+                    exit
+            """}
+        nvm = make_scaled_nvm(["r0"], programs, extra_tokens=["A","B"], orthogonal=True)
+        nvm.assemble(programs)
+
+        # fresh orthogonal ip patterns are learned as exactly as the first ones
+        _, _, diff_count = assemble(nvm.net, programs, orthogonal=True,
+            other_tokens=nvm.tokens)
+        self.assertEqual(diff_count, 0)
+
+    def test_incremental_solver(self):
+
+        np.random.seed(0)
+        N, P = 64, 50
+        act = tanh_activator(.0001, N)
+        X, Y = act.make_pattern(P + 30), act.make_pattern(P + 30)
+        def check(solver, columns):
+            w, b = solver.weights()
+            w0, b0 = linear_solve(None, None, X[:,columns], Y[:,columns], act, act)
+            self.assertTrue(np.allclose(w, w0) and np.allclose(b, b0))
+
+        # appended and removed pairs, while factored
+        solver = IncrementalSolver(N, N)
+        for p in range(0, P, 8):
+            columns = list(range(p, min(P, p+8)))
+            solver.add(X[:,columns], act.g(Y[:,columns]), columns)
+        self.assertTrue(solver.L is not None)
+        check(solver, list(range(P)))
+        solver.remove([3, 20, 49])
+        columns = [p for p in range(P) if p not in [3, 20, 49]]
+        self.assertTrue(solver.keys == columns)
+        check(solver, columns)
+
+        # more pairs than inputs are solved from scratch, and refactored when removed
+        solver.add(X[:,P:], act.g(Y[:,P:]))
+        self.assertTrue(solver.L is None)
+        check(solver, columns + list(range(P, P + 30)))
+        solver.remove(range(len(columns), len(columns) + 30))
+        self.assertTrue(solver.L is not None)
+        check(solver, columns)
+
+    def test_address_solvers(self):
+
+        programs = {"test": """
+        start:  exit
+        """}
+        net = make_scaled_nvm(["r0"], programs).net
+
+        # not kept after construction, but rebuilt with the same solutions
+        self.assertTrue(len(net.solvers) == 0)
+        for key in net.address_spaces():
+            w, b = net.get_solver(key).weights(net.weight_dtype)
+            self.assertTrue(np.array_equal(w, net.weights[key]))
+            self.assertTrue(np.array_equal(b, net.biases[key]))
+
+        # and left out of the state
+        self.assertTrue(len(net.get_state()["solvers"]) == 0)
+
+class NetworkCacheTestCase(ut.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_reload(self):
+
+        programs = {"test": """
+        start:  mov r0 A
+                jmp start
+        """}
+        cache = NetworkCache(self.directory)
+        def build(**kwargs):
+            nvm = make_scaled_nvm(["r0"], programs, extra_tokens=["A"], cache=cache, **kwargs)
+            nvm.assemble(programs)
+            return nvm.net
+
+        # constructed and assembled states are stored, then reloaded
+        net = build(seed=0)
+        self.assertTrue((cache.hits, cache.misses) == (0, 2))
+        reloaded = build(seed=0)
+        self.assertTrue((cache.hits, cache.misses) == (2, 2))
+        self.assertTrue(sorted(net.weights.keys()) == sorted(reloaded.weights.keys()))
+        for k in net.weights:
+            self.assertTrue(np.array_equal(net.weights[k], reloaded.weights[k]))
+        for name in net.layers:
+            self.assertTrue(sorted(net.layers[name].coder.list_tokens()) ==
+                sorted(reloaded.layers[name].coder.list_tokens()))
+        self.assertTrue(net.ip_table == reloaded.ip_table)
+
+        # unseeded nets are not cached, nor is assembly after plasticity
+        build()
+        self.assertTrue((cache.hits, cache.misses) == (2, 2))
+        reloaded.initialize_memory({}, {"0": {"r0": "A"}})
+        reloaded.assemble(programs)
+        self.assertTrue((cache.hits, cache.misses) == (2, 2))
+
+        # bypass recomputes
+        cache.bypass = True
+        build(seed=0)
+        self.assertTrue((cache.hits, cache.misses) == (2, 4))
+
+    def test_eviction(self):
+
+        cache = NetworkCache(self.directory, max_bytes=2**15)
+        for key in "abc":
+            cache.store(key, np.zeros(2**10))
+            os.utime(cache.path(key), (0, ord(key))) # distinct ages
+        cache.load("a") # most recently used
+        cache.store("d", np.zeros(2**10))
+        self.assertTrue(cache.load("b") is None)
+        self.assertTrue(all(cache.load(key) is not None for key in "acd"))
+
+class NVMProfilerTestCase(ut.TestCase):
+
+    def test_counts(self):
+
+        program = """
+        start:  mov r0 A
+                mem r0
+                exit
+        """
+        programs = {"test": program}
+        nvm = make_scaled_nvm(["r0"], programs,
+            orthogonal=True, extra_tokens=["A"])
+        nvm.assemble(programs, other_tokens=["A"])
+        nvm.load("test", {"r0": None})
+
+        profiler = nvm.net.start_profiling()
+        while not nvm.at_exit(): self.assertTrue(nvm.step())
+        self.assertTrue(nvm.net.stop_profiling() is profiler)
+
+        counts = profiler.as_dict()
+        instructions = counts["instructions"]
+        self.assertTrue(sorted(instructions.keys()) == ["exit", "mem", "movv"])
+        self.assertTrue(sum(t for _, t in instructions.values()) == counts["ticks"])
+        self.assertTrue(counts["open_counts"][("r0", "mf", "l")] > 0)
+        self.assertTrue(("r0", "mf") in counts["learning_times"])
+        self.assertTrue("r0" in counts["layer_times"])
+        for (to_layer, from_layer) in counts["forward_times"]:
+            self.assertTrue((to_layer, from_layer, "u") in counts["open_counts"])
+        self.assertTrue(("ip", "ip") in counts["forward_times"])
+        self.assertTrue(max(counts["open_counts"].values()) <= counts["ticks"])
+
+    def test_health(self):
+
+        program = """
+        start:  mov r0 A
+                exit
+        """
+        programs = {"test": program}
+        nvm = make_scaled_nvm(["r0"], programs, extra_tokens=["A"])
+        nvm.assemble(programs, other_tokens=["A"])
+        nvm.load("test", {"r0": None})
+
+        monitor = nvm.net.start_monitoring(every=3, capacity=4,
+            max_corrosion={"gh": 0.})
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            while not nvm.at_exit(): self.assertTrue(nvm.step())
+        self.assertTrue(nvm.net.stop_monitoring() is monitor)
+        self.assertTrue(monitor.count == monitor.ticks // 3)
+
+        # the last samples are kept, and match per-layer measurements
+        history = monitor.history("r0")
+        self.assertTrue(list(history["tick"]) ==
+            list(range(3*monitor.count - 9, 3*monitor.count + 1, 3)))
+        if monitor.ticks == history["tick"][-1]:
+            self.assertTrue(np.isclose(history["corrosion"][-1,0],
+                nvm.net.layers["r0"].activator.corrosion(nvm.net.activity["r0"])))
+
+        # most gh hidden patterns are not binary, so only it warns
+        caught = [w for w in caught if issubclass(w.category, HealthWarning)]
+        self.assertTrue(len(caught) == len(monitor.warnings) > 0)
+        self.assertTrue(all(w[1:3] == ("gh", "corrosion") for w in monitor.warnings))
+
 if __name__ == "__main__":
     test_suite = ut.TestLoader().loadTestsFromTestCase(RefVMTestCase)
     ut.TextTestRunner(verbosity=2).run(test_suite)
@@ -546,3 +1286,42 @@ if __name__ == "__main__":
 
     test_suite = ut.TestLoader().loadTestsFromTestCase(NVMOrthogonalTestCase)
     ut.TextTestRunner(verbosity=2).run(test_suite)
+
+    test_suite = ut.TestLoader().loadTestsFromTestCase(NVMBlockEngineTestCase)
+    ut.TextTestRunner(verbosity=2).run(test_suite)
+
+    test_suite = ut.TestLoader().loadTestsFromTestCase(NVMFloat32TestCase)
+    ut.TextTestRunner(verbosity=2).run(test_suite)
+
+    test_suite = ut.TestLoader().loadTestsFromTestCase(NVMFloat16BlockTestCase)
+    ut.TextTestRunner(verbosity=2).run(test_suite)
+
+    test_suite = ut.TestLoader().loadTestsFromTestCase(NVMThreadedTestCase)
+    ut.TextTestRunner(verbosity=2).run(test_suite)
+
+    test_suite = ut.TestLoader().loadTestsFromTestCase(NVMLowRankTestCase)
+    ut.TextTestRunner(verbosity=2).run(test_suite)
+
+    test_suite = ut.TestLoader().loadTestsFromTestCase(NVMDeferredPlasticityTestCase)
+    ut.TextTestRunner(verbosity=2).run(test_suite)
+
+    test_suite = ut.TestLoader().loadTestsFromTestCase(NVMFastPathTestCase)
+    ut.TextTestRunner(verbosity=2).run(test_suite)
+
+    test_suite = ut.TestLoader().loadTestsFromTestCase(NVMPackedPatternsTestCase)
+    ut.TextTestRunner(verbosity=2).run(test_suite)
+
+    test_suite = ut.TestLoader().loadTestsFromTestCase(NVMBatchTestCase)
+    ut.TextTestRunner(verbosity=2).run(test_suite)
+
+    test_suite = ut.TestLoader().loadTestsFromTestCase(CoderTestCase)
+    ut.TextTestRunner(verbosity=2).run(test_suite)
+
+    test_suite = ut.TestLoader().loadTestsFromTestCase(LearningRuleTestCase)
+    ut.TextTestRunner(verbosity=2).run(test_suite)
+
+    test_suite = ut.TestLoader().loadTestsFromTestCase(NetworkCacheTestCase)
+    ut.TextTestRunner(verbosity=2).run(test_suite)
+
+    test_suite = ut.TestLoader().loadTestsFromTestCase(NVMProfilerTestCase)
+    ut.TextTestRunner(verbosity=2).run(test_suite)
@@ -0,0 +1,56 @@
+import numpy as np
+
+class TickPlan:
+    """
+    Precompiled gate indices for the pathways and layers updated by NVMNet.tick.
+    Built once after assembly, so that each tick can threshold the whole gate
+    pattern in one vectorized operation and only visit the open pathways.
+    Gate patterns may have several columns (one per batched instance), in
+    which case gate values are returned per column and zero where closed.
+    """
+
+    def __init__(self, gate_map, pathways, layer_names):
+        """
+        gate_map: the GateMap of the network
+        pathways: list of (to_layer, from_layer) keys with weights
+        layer_names: list of all layer names
+        """
+        self.pathways = list(pathways)
+        self.layer_names = list(layer_names)
+
+        # pathway -> update and learning gate positions in the gate pattern
+        self.u_index = np.array([
+            gate_map.get_gate_index((to_layer, from_layer, 'u'))
+            for (to_layer, from_layer) in self.pathways], dtype=int)
+        self.l_index = np.array([
+            gate_map.get_gate_index((to_layer, from_layer, 'l'))
+            for (to_layer, from_layer) in self.pathways], dtype=int)
+
+        # layer -> decay gate position in the gate pattern
+        self.d_index = np.array([
+            gate_map.get_gate_index((name, name, 'd'))
+            for name in self.layer_names], dtype=int)
+
+    def is_stale(self, weights):
+        """Whether pathways have been added since the plan was compiled"""
+        return len(weights) != len(self.pathways)
+
+    def _open(self, keys, values, threshold=.5):
+        # values has one column per instance; closed columns are zeroed
+        is_open = values > threshold
+        return [(keys[i], values[i] * is_open[i])
+            for i in np.flatnonzero(is_open.any(axis=1))]
+
+    def open_updates(self, gate_pattern):
+        """List of (pathway, u) for pathways with open update gates"""
+        return self._open(self.pathways, gate_pattern[self.u_index])
+
+    def open_learning(self, gate_pattern):
+        """List of (pathway, l) for pathways with open learning gates"""
+        return self._open(self.pathways, gate_pattern[self.l_index])
+
+    def decays(self, gate_pattern, pad):
+        """List of (layer name, s) for layers whose own activity persists"""
+        # s = (1 - pad) - d > .5
+        return self._open(self.layer_names,
+            (1 - pad) - gate_pattern[self.d_index])
@@ -0,0 +1,86 @@
+import csv
+import time
+
+class TickProfiler:
+    """
+    Counters for NVMNet.tick and NVM.step, see NVMNet.start_profiling.
+    Records how often each gate was open, the wall time spent computing the
+    new activity of each layer, in the forward product of each pathway and in
+    the plasticity of each pathway, and the number of ticks taken per
+    instruction, by opcode.
+    Keys follow the gate map: (to_layer, from_layer, 'u'|'l'|'d').
+    Pathways packed together by the block engine share one product, so their
+    forward time is recorded under (to_layer, "from_1+from_2+...").
+    """
+
+    def __init__(self):
+        self.ticks = 0
+        self.open_counts = {} # gate key -> number of ticks open
+        self.layer_times = {} # layer name -> [calls, seconds]
+        self.forward_times = {} # pathway -> [calls, seconds]
+        self.learning_times = {} # pathway -> [calls, seconds]
+        self.instructions = {} # opcode -> [instructions, ticks]
+
+    def count_tick(self, open_updates, decays, open_learning):
+        """Count one tick and the gates that were open"""
+        self.ticks += 1
+        keys = [pathway + ('u',) for pathway in open_updates] + \
+            [(name, name, 'd') for name in decays] + \
+            [pathway + ('l',) for pathway in open_learning]
+        for key in keys:
+            self.open_counts[key] = self.open_counts.get(key, 0) + 1
+
+    def add_time(self, times, key, start):
+        """Accumulate the wall time since start under key"""
+        calls, seconds = times.get(key, (0, 0.))
+        times[key] = [calls + 1, seconds + time.time() - start]
+
+    def timed(self, times, function):
+        """Wrap function to accumulate its wall time, keyed by its first argument"""
+        def timed_function(key, *args):
+            start = time.time()
+            result = function(key, *args)
+            self.add_time(times, key, start)
+            return result
+        return timed_function
+
+    def count_instruction(self, opcode, ticks):
+        """Count one instruction and the ticks it took (0 if fast-pathed)"""
+        count, total = self.instructions.get(opcode, (0, 0))
+        self.instructions[opcode] = [count + 1, total + ticks]
+
+    def as_dict(self):
+        return {
+            "ticks": self.ticks,
+            "open_counts": dict(self.open_counts),
+            "layer_times": {k: tuple(v) for k, v in self.layer_times.items()},
+            "forward_times": {k: tuple(v) for k, v in self.forward_times.items()},
+            "learning_times": {k: tuple(v) for k, v in self.learning_times.items()},
+            "instructions": {k: tuple(v) for k, v in self.instructions.items()},
+        }
+
+    def rows(self):
+        """
+        Flat (kind, key, count, total) rows:
+            gate: ticks open, out of total ticks
+            layer, forward, learning: calls, total seconds
+            instruction: instructions, total ticks
+        """
+        rows = []
+        for (to_layer, from_layer, g), count in sorted(self.open_counts.items()):
+            rows.append(("gate", "%s<%s:%s"%(to_layer, from_layer, g), count, self.ticks))
+        for name, (calls, seconds) in sorted(self.layer_times.items()):
+            rows.append(("layer", name, calls, seconds))
+        for (to_layer, from_layer), (calls, seconds) in sorted(self.forward_times.items()):
+            rows.append(("forward", "%s<%s"%(to_layer, from_layer), calls, seconds))
+        for (to_layer, from_layer), (calls, seconds) in sorted(self.learning_times.items()):
+            rows.append(("learning", "%s<%s"%(to_layer, from_layer), calls, seconds))
+        for opcode, (count, ticks) in sorted(self.instructions.items()):
+            rows.append(("instruction", opcode, count, ticks))
+        return rows
+
+    def to_csv(self, filename):
+        with open(filename, "w") as f:
+            writer = csv.writer(f)
+            writer.writerow(("kind", "key", "count", "total"))
+            writer.writerows(self.rows())
@@ -290,7 +290,7 @@ class OpNet:
 
 
         # OP squash
-        w = op_layer.activator.g(op_layer.coder.encode("null")) * 10
+        w = op_layer.coder.encode_g("null") * 10
         syngen_net.net.get_weight_matrix(
             get_conn_name(self.op_register, self.op_register,
                 self.op_name + "-squash")).copy_from(w.flat)
@@ -302,8 +302,12 @@ def make_syngen_network(nvmnet):
 
 
 def init_syngen_nvm_weights(nvmnet, syngen_net):
+    # Apply any deferred plasticity first, so the weights are current
+    nvmnet.flush_plasticity()
+
     # Initialize weights
     for (to_name, from_name), w in nvmnet.weights.items():
+        w = np.asarray(w) # densifies low rank weights
         if np.count_nonzero(w) > 0:
             syngen_net.get_weight_matrix(
                 get_conn_name(to_name, from_name, "weights")).copy_from(w.flat)
@@ -321,9 +325,8 @@ def init_syngen_nvm_weights(nvmnet, syngen_net):
 
     # Initialize comparison true pattern
     co = nvmnet.layers["co"]
-    co_true = co.coder.encode("true")
     syngen_net.get_neuron_data(
-        "nvm", "co", "true_state").copy_from(co.activator.g(co_true.flat))
+        "nvm", "co", "true_state").copy_from(co.coder.encode_g("true").flat)
 
 def init_syngen_nvm_activity(activity, syngen_net):
     for layer_name, activity in activity.items():
@@ -486,7 +489,7 @@ def make_stream_modules(nvmnet, op_reg, data_reg, producer, consumer):
             ready,sym = producer()
             if ready:
                 StreamState.state = "reset"
-                data += data_layer.activator.g(data_layer.coder.encode(sym)).flat
+                data += data_layer.coder.encode_g(sym).flat
                 data *= 10
 
     def stream_data_out(name, data):
@@ -144,6 +144,21 @@ class SyngenNVMTestCase(NVMTestCase):
             shapes_override={'gh':gh_shape},
             verbose=verbose)
 
+class SyngenNVMLowRankTestCase(SyngenNVMTestCase):
+
+    def _make_vm(self, num_registers, programs, extra_tokens, verbose=False):
+        gh_shape = (32,16) if num_registers < 4 else (32,48)
+        return make_scaled_nvm(
+            register_names = ["r%d"%r for r in range(num_registers)],
+            programs = programs,
+            orthogonal=False,
+            extra_tokens=extra_tokens,
+            scale_factor=1.05,
+            shapes_override={'gh':gh_shape},
+            low_rank=True,
+            verbose=verbose)
+
+
 
 class SyngenNVMArithTestCase(ut.TestCase):
     in_range = range(-1,10)
@@ -866,6 +881,9 @@ if __name__ == "__main__":
     test_suite = ut.TestLoader().loadTestsFromTestCase(SyngenNVMTestCase)
     ut.TextTestRunner(verbosity=2).run(test_suite)
 
+    test_suite = ut.TestLoader().loadTestsFromTestCase(SyngenNVMLowRankTestCase)
+    ut.TextTestRunner(verbosity=2).run(test_suite)
+
     test_suite = ut.TestLoader().loadTestsFromTestCase(SyngenNVMArithTestCase)
     ut.TextTestRunner(verbosity=2).run(test_suite)
 
@@ -292,8 +292,7 @@ class GraphNet:
                 inp = next(input_iters[layer_name])
                 if inp is not None:
                     np.copyto(data,
-                        self.acts[layer_name].g(
-                            self.coders[layer_name].encode(inp)).flat)
+                        self.coders[layer_name].encode_g(inp).flat)
             except StopIteration:
                 interrupt_engine()
             except Exception as e:
@@ -314,8 +313,7 @@ class GraphNet:
                     else:
                         test_state[layer_name]["w_correct"] += (
                             np.sum(np.sign(data) == np.sign(
-                                self.acts[layer_name].g(
-                                    self.coders[layer_name].encode(tok))).flat)
+                                self.coders[layer_name].encode_g(tok)).flat)
                             / data.size)
                     test_state[layer_name]["total"] += 1
             except StopIteration: